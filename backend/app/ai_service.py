@@ -1213,7 +1213,7 @@ def _compile_latex_snapshot(
         def _run_once(source: str) -> tuple[bool, int, str]:
             with tempfile.TemporaryDirectory() as tmpdir:
                 tex_path = Path(tmpdir) / "check.tex"
-                tex_path.write_text(source, encoding="utf-8")
+                tex_path.write_bytes(source.encode("utf-8"))
 
                 cmd_args = get_compile_args(LUALATEX_CMD, str(tmpdir), str(tex_path))
                 from .pdf_service import _make_subprocess_limits
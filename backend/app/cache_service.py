@@ -12,7 +12,9 @@ import json
 import logging
 import os
 import shutil
+import tempfile
 import time
+import uuid
 from pathlib import Path
 from typing import Optional
 
@@ -42,26 +44,35 @@ def _ensure_dirs():
 _ensure_dirs()
 
 
-def _hash_document(doc_dict: dict) -> str:
-    """ドキュメント辞書から安定したハッシュを生成"""
-    # blocks と settings のみをハッシュ対象にする（metadata の変更はPDFに影響するので含む）
-    canonical = json.dumps(doc_dict, sort_keys=True, ensure_ascii=False)
-    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+def _svg_cache_key(code: str, block_type: str) -> str:
+    """SVG キャッシュキー (BLAKE2b-96)。
 
-
-def _hash_string(s: str) -> str:
-    """文字列のハッシュ"""
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()[:32]
+    f"{block_type}:{code}" の連結文字列を作らず、2 つを別々に update() する。
+    """
+    h = hashlib.blake2b(digest_size=12)
+    h.update(block_type.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(code.encode("utf-8"))
+    return h.hexdigest()
 
 
 # ═══════════════════════════════════════════════════════════════
 # PDF キャッシュ
 # ═══════════════════════════════════════════════════════════════
 
-def get_cached_pdf(doc_dict: dict) -> Optional[bytes]:
-    """キャッシュされたPDFを取得。なければ None"""
-    cache_key = _hash_document(doc_dict)
-    pdf_path = PDF_CACHE_DIR / f"{cache_key}.pdf"
+def pdf_cache_path(cache_key: str) -> Path:
+    """キャッシュキーに対応する PDF キャッシュファイルのパス (存在は保証しない)"""
+    return PDF_CACHE_DIR / f"{cache_key}.pdf"
+
+
+def get_cached_pdf_path(cache_key: str) -> Optional[Path]:
+    """キャッシュされたPDFのパスを取得。なければ None
+
+    中身を読み込まないので、HTTP 層が FileResponse でディスクから直接
+    送出できる (PDF 全体を bytes としてメモリに載せずに済む)。
+    キャッシュキーは呼び出し側 (pdf_service) がドキュメントから計算する。
+    """
+    pdf_path = pdf_cache_path(cache_key)
     meta_path = PDF_CACHE_DIR / f"{cache_key}.meta"
 
     if not pdf_path.exists() or not meta_path.exists():
@@ -80,29 +91,141 @@ def get_cached_pdf(doc_dict: dict) -> Optional[bytes]:
         return None
 
     try:
-        pdf_bytes = pdf_path.read_bytes()
         # アクセス時刻を更新 (LRU)
         pdf_path.touch()
         meta_path.touch()
         logger.info(f"[cache] PDF hit: {cache_key}")
-        return pdf_bytes
+        return pdf_path
+    except Exception:
+        return None
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """同じディレクトリの一時ファイルに書いてから os.replace で差し替える。
+
+    読み手 (FileResponse / get_cached_pdf) が書きかけのファイルを掴まないようにする。
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+# 送出用ファイル (.serving) の掃除間隔 (秒) と、前回掃除した時刻
+_SERVING_SWEEP_INTERVAL = 60.0
+_last_serving_sweep = 0.0
+
+
+def _serving_path(cache_key: str) -> Path:
+    """送出専用のパス。作成時刻を名前に埋め込む。
+
+    ハードリンクは inode (= mtime) をキャッシュ本体と共有し、ヒットのたびの
+    touch() で mtime が更新され続けるので、放置判定には名前の時刻を使う。
+    """
+    return PDF_CACHE_DIR / f"{cache_key}.{int(time.time())}-{uuid.uuid4().hex}.serving"
+
+
+def _serving_created_at(path: Path) -> float:
+    """_serving_path() の名前から作成時刻を読む。読めなければ mtime で代用"""
+    try:
+        return float(path.name.rsplit(".", 2)[1].split("-", 1)[0])
+    except (IndexError, ValueError):
+        return path.stat().st_mtime
+
+
+def link_pdf_for_serving(pdf_path: Path) -> Optional[Path]:
+    """キャッシュ上の PDF を送出専用のパスへハードリンク (不可ならコピー) する。
+
+    TTL 失効や LRU 追い出しで元ファイルが unlink されても、リンク先は
+    呼び出し側が削除するまで残る。元ファイルが既に無ければ None。
+    """
+    _sweep_stale_serving_files()
+    dest = _serving_path(pdf_path.stem)
+    try:
+        os.link(pdf_path, dest)
+        return dest
+    except FileNotFoundError:
+        return None
+    except OSError:
+        pass  # ハードリンク非対応のファイルシステム → コピーで代替
+    try:
+        shutil.copyfile(pdf_path, dest)
+        return dest
+    except OSError:
+        dest.unlink(missing_ok=True)
+        return None
+
+
+def write_pdf_for_serving(cache_key: str, pdf_bytes: bytes) -> Path:
+    """キャッシュに置けなかった PDF を送出専用のパスへ直接書く。
+
+    キャッシュと同じディレクトリ・同じ名前規則なので、送出中に異常終了しても
+    _sweep_stale_serving_files() が回収する。
+    """
+    _ensure_dirs()
+    _sweep_stale_serving_files()
+    dest = _serving_path(cache_key)
+    _atomic_write_bytes(dest, pdf_bytes)
+    return dest
+
+
+def _sweep_stale_serving_files() -> None:
+    """プロセス異常終了などで残った送出用ファイル・書きかけの一時ファイルを消す。
+
+    送出にかかる時間より十分長い CACHE_TTL を過ぎたものだけが対象。
+    リクエストごとに呼ばれるので、ディレクトリの走査は一定間隔に間引く。
+    """
+    global _last_serving_sweep
+    now = time.time()
+    if now - _last_serving_sweep < _SERVING_SWEEP_INTERVAL:
+        return
+    _last_serving_sweep = now
+    cutoff = now - CACHE_TTL
+    try:
+        for leftover in PDF_CACHE_DIR.glob("*.serving"):
+            try:
+                if _serving_created_at(leftover) < cutoff:
+                    leftover.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+        # _atomic_write_bytes の一時ファイルはリンクされないので mtime で判定できる
+        for leftover in PDF_CACHE_DIR.glob(".*.tmp"):
+            try:
+                if leftover.stat().st_mtime < cutoff:
+                    leftover.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+    except OSError as e:
+        logger.warning(f"[cache] Serving-file sweep error: {e}")
+
+
+def get_cached_pdf(cache_key: str) -> Optional[bytes]:
+    """キャッシュされたPDFを取得。なければ None"""
+    pdf_path = get_cached_pdf_path(cache_key)
+    if pdf_path is None:
+        return None
+    try:
+        return pdf_path.read_bytes()
     except Exception:
         return None
 
 
-def store_cached_pdf(doc_dict: dict, pdf_bytes: bytes) -> str:
+def store_cached_pdf(cache_key: str, pdf_bytes: bytes) -> str:
     """PDFをキャッシュに保存。キャッシュキーを返す"""
     _ensure_dirs()
-    cache_key = _hash_document(doc_dict)
-    pdf_path = PDF_CACHE_DIR / f"{cache_key}.pdf"
+    pdf_path = pdf_cache_path(cache_key)
     meta_path = PDF_CACHE_DIR / f"{cache_key}.meta"
 
     try:
-        pdf_path.write_bytes(pdf_bytes)
-        meta_path.write_text(json.dumps({
+        _atomic_write_bytes(pdf_path, pdf_bytes)
+        _atomic_write_bytes(meta_path, json.dumps({
             "created": time.time(),
             "size": len(pdf_bytes),
-        }))
+        }).encode())
         logger.info(f"[cache] PDF stored: {cache_key} ({len(pdf_bytes)} bytes)")
 
         # キャッシュサイズ制限の適用
@@ -141,7 +264,7 @@ def _enforce_pdf_cache_limit():
 
 def get_cached_svg(code: str, block_type: str) -> Optional[str]:
     """キャッシュされたSVGを取得。なければ None"""
-    cache_key = _hash_string(f"{block_type}:{code}")
+    cache_key = _svg_cache_key(code, block_type)
     svg_path = SVG_CACHE_DIR / f"{cache_key}.svg"
 
     if not svg_path.exists():
@@ -168,7 +291,7 @@ def get_cached_svg(code: str, block_type: str) -> Optional[str]:
 def store_cached_svg(code: str, block_type: str, svg: str) -> str:
     """SVGをキャッシュに保存"""
     _ensure_dirs()
-    cache_key = _hash_string(f"{block_type}:{code}")
+    cache_key = _svg_cache_key(code, block_type)
     svg_path = SVG_CACHE_DIR / f"{cache_key}.svg"
 
     try:
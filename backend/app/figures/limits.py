@@ -0,0 +1,16 @@
+"""Concurrency limit shared by every figure render (asset previews and snippets).
+
+Separate from pdf_service's admission control, so a burst of figure renders
+can't take more than PREVIEW_MAX_CONCURRENT lualatex slots away from
+full-document builds.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+
+# One budget for both preview.py and snippet.py, which used to hold a
+# Semaphore(2) each (4 renders total). The default of 2 deliberately halves
+# that on the 512 MB box; raise it where memory allows.
+PREVIEW_MAX_CONCURRENT = int(os.environ.get("PREVIEW_MAX_CONCURRENT", "2"))
+FIGURE_RENDER_LIMIT = asyncio.Semaphore(PREVIEW_MAX_CONCURRENT)
@@ -13,16 +13,18 @@ import tempfile
 from pathlib import Path
 from typing import Any
 
+from ..latex_runner import decode_log_tail, run_tex_tool
 from ..security import get_compile_args
-from ..tex_env import LUALATEX_CMD, TEX_ENV
+from ..tex_env import LUALATEX_CMD, PDFCROP_CMD, PDFTOPPM_CMD
+from .limits import FIGURE_RENDER_LIMIT
 from .loader import asset_root
+from .raster import PREVIEW_DPI, render_first_page_png
 from .registry import FigureRegistry, get_registry
 from .render import render_asset
 
 logger = logging.getLogger(__name__)
 
 _PREVIEW_TIMEOUT_SEC = 30
-_preview_semaphore = asyncio.Semaphore(2)
 
 
 class PreviewError(RuntimeError):
@@ -78,15 +80,8 @@ def _standalone_doc(asset: dict[str, Any]) -> str:
     return "\n".join(lines) + "\n"
 
 
-def _run(cmd: list[str], cwd: str) -> subprocess.CompletedProcess:
-    return subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        timeout=_PREVIEW_TIMEOUT_SEC,
-        cwd=cwd,
-        env=TEX_ENV,
-    )
+def _run(cmd: list[str], cwd: str, *, discard_output: bool = False) -> subprocess.CompletedProcess:
+    return run_tex_tool(cmd, cwd, _PREVIEW_TIMEOUT_SEC, discard_output=discard_output)
 
 
 def _build_png_sync(asset_id: str) -> Path:
@@ -103,42 +98,45 @@ def _build_png_sync(asset_id: str) -> Path:
     with tempfile.TemporaryDirectory(prefix="figprev_") as tmpdir:
         tex_path = Path(tmpdir) / "fig.tex"
         pdf_path = Path(tmpdir) / "fig.pdf"
-        tex_path.write_text(tex, encoding="utf-8")
+        tex_path.write_bytes(tex.encode("utf-8"))
 
         cmd_args = get_compile_args(LUALATEX_CMD, tmpdir, str(tex_path))
         result = _run(cmd_args, tmpdir)
         if result.returncode != 0 or not pdf_path.exists():
-            tail = (result.stdout + "\n" + result.stderr)[-2000:]
+            tail = decode_log_tail(result.stdout, result.stderr)[-2000:]
             raise PreviewError(f"lualatex failed for {asset_id}: {tail}")
 
         # Crop the PDF to its ink bounding box. This rescues circuitikz
         # (which standalone's [tikz] wrapper doesn't cover) and any figure
         # that leaks whitespace from the document class defaults.
-        pdfcrop = shutil.which("pdfcrop")
+        pdfcrop = PDFCROP_CMD
         if pdfcrop:
             cropped = Path(tmpdir) / "fig-cropped.pdf"
             r = _run(
                 [pdfcrop, "--margins", "6", str(pdf_path), str(cropped)],
                 tmpdir,
+                discard_output=True,
             )
             if r.returncode == 0 and cropped.exists():
                 pdf_path = cropped
             else:
-                logger.warning("[figures] pdfcrop failed for %s: %s", asset_id, r.stderr[-300:])
+                # discard_output=True なので stderr は無い。終了コードだけ残す
+                logger.warning("[figures] pdfcrop failed for %s (exit=%d)", asset_id, r.returncode)
 
-        pdftoppm = shutil.which("pdftoppm")
-        if pdftoppm:
+        png_out = Path(tmpdir) / "page.png"
+        if render_first_page_png(pdf_path, png_out):
+            shutil.copyfile(png_out, out)
+        elif pdftoppm := PDFTOPPM_CMD:
             png_prefix = Path(tmpdir) / "page"
             r = _run(
-                [pdftoppm, "-png", "-r", "180", "-singlefile", str(pdf_path), str(png_prefix)],
+                [pdftoppm, "-png", "-r", str(PREVIEW_DPI), "-singlefile", str(pdf_path), str(png_prefix)],
                 tmpdir,
             )
-            png_out = Path(tmpdir) / "page.png"
             if r.returncode != 0 or not png_out.exists():
                 # Fallback: non-singlefile variant writes page-1.png etc.
                 candidates = sorted(Path(tmpdir).glob("page*.png"))
                 if not candidates:
-                    raise PreviewError(f"pdftoppm failed for {asset_id}: {r.stderr[-500:]}")
+                    raise PreviewError(f"pdftoppm failed for {asset_id}: {r.stderr[-500:].decode('utf-8', errors='replace')}")
                 png_out = candidates[0]
             shutil.copyfile(png_out, out)
         else:
@@ -157,7 +155,7 @@ async def ensure_preview(asset_id: str) -> Path:
     out = preview_path(asset_id)
     if out.exists() and out.stat().st_size > 0:
         return out
-    async with _preview_semaphore:
+    async with FIGURE_RENDER_LIMIT:
         if out.exists() and out.stat().st_size > 0:
             return out
         loop = asyncio.get_event_loop()
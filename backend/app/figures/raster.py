@@ -0,0 +1,86 @@
+"""In-process PDF → PNG rasterization for figure previews.
+
+Uses PyMuPDF (already a backend dependency for OMR) so a preview doesn't pay
+for a `pdftoppm` fork/exec + poppler/fontconfig init on every figure. Callers
+keep the `pdftoppm` subprocess as the fallback when this returns False.
+
+This runs inside the API process: no rlimits, no timeout, and PyMuPDF holds the
+GIL while it draws, so a slow render stalls the event loop and every request.
+Two guards keep it to small, cheap pages:
+
+  - pages whose content streams (including nested form XObjects, which is where
+    pdfcrop puts the original page) exceed PREVIEW_INPROCESS_MAX_BYTES are
+    refused, and the caller falls back to the time-limited `pdftoppm`;
+  - a page whose size at `dpi` would exceed PREVIEW_MAX_PIXELS is rendered at a
+    reduced resolution. Without the cap a 6000pt page at 180 dpi needs well over
+    1 GB of RSS.
+
+User-supplied snippets (snippet.py) don't come through here by default; they
+go to `pdftoppm` under the compile rlimits.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Same resolution the `pdftoppm -r 180` path used, so cached PNGs match.
+PREVIEW_DPI = 180
+
+# Pixel budget per preview (RGB, so ~3 bytes/pixel → ~50 MB at the default).
+PREVIEW_MAX_PIXELS = int(os.environ.get("PREVIEW_MAX_PIXELS", str(4096 * 4096)))
+
+# Compressed content-stream bytes a page may carry and still be drawn in-process.
+# Dense stroked paths cost roughly 1.5 s per 20 KB here, so the default keeps
+# the worst case around a second; typical library figures are a few KB.
+PREVIEW_INPROCESS_MAX_BYTES = int(os.environ.get("PREVIEW_INPROCESS_MAX_BYTES", str(16 * 1024)))
+
+
+def _page_content_bytes(doc, page) -> int:
+    """Compressed size of the page's content streams plus every form XObject it draws."""
+    xrefs = [*page.get_contents(), *(x[0] for x in page.get_xobjects())]
+    return sum(len(doc.xref_stream_raw(x) or b"") for x in xrefs)
+
+
+def render_first_page_png(pdf_path: Path, out_path: Path, dpi: int = PREVIEW_DPI) -> bool:
+    """Rasterize page 1 of `pdf_path` to `out_path`. Returns False on any failure."""
+    try:
+        import fitz
+    except ImportError:
+        return False
+
+    try:
+        with fitz.open(str(pdf_path)) as doc:
+            if doc.page_count == 0:
+                return False
+            page = doc[0]
+            # The whole file is an upper bound on its streams, so small PDFs skip the scan.
+            if pdf_path.stat().st_size > PREVIEW_INPROCESS_MAX_BYTES:
+                content = _page_content_bytes(doc, page)
+                if content > PREVIEW_INPROCESS_MAX_BYTES:
+                    logger.info(
+                        "[figures] %s has %d bytes of page content; leaving it to pdftoppm",
+                        pdf_path.name, content,
+                    )
+                    return False
+            zoom = dpi / 72
+            rect = page.rect
+            area = rect.width * rect.height
+            if area <= 0:
+                return False
+            if area * zoom * zoom > PREVIEW_MAX_PIXELS:
+                capped = math.sqrt(PREVIEW_MAX_PIXELS / area)
+                logger.warning(
+                    "[figures] %s is %.0fx%.0fpt; rendering at %.0f dpi instead of %d to stay within %d pixels",
+                    pdf_path.name, rect.width, rect.height, capped * 72, dpi, PREVIEW_MAX_PIXELS,
+                )
+                zoom = capped
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            pix.save(str(out_path))
+    except Exception as e:
+        logger.warning("[figures] PyMuPDF render failed for %s: %s", pdf_path.name, e)
+        return False
+    return out_path.exists()
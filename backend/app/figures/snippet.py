@@ -18,19 +18,21 @@ import tempfile
 import time
 from pathlib import Path
 
+from ..latex_runner import decode_log_tail, run_tex_tool
 from ..security import (
     ALLOWED_PACKAGES,
     ALLOWED_TIKZ_LIBRARIES,
     get_compile_args,
     validate_latex_security,
 )
-from ..tex_env import LUALATEX_CMD, TEX_ENV
+from ..tex_env import LUALATEX_CMD, PDFCROP_CMD, PDFTOPPM_CMD
+from .limits import FIGURE_RENDER_LIMIT
 from .loader import asset_root
+from .raster import PREVIEW_DPI, render_first_page_png
 
 logger = logging.getLogger(__name__)
 
 _PREVIEW_TIMEOUT_SEC = 30
-_snippet_semaphore = asyncio.Semaphore(2)
 _MAX_SNIPPET_LEN = 16 * 1024
 
 _TIKZ_ENV_RE = re.compile(
@@ -161,13 +163,15 @@ def _detect_libraries(src: str) -> list[str]:
 
 
 def snippet_hash(body: str, pkgs: list[str], libs: list[str]) -> str:
-    h = hashlib.sha256()
+    # BLAKE2b with a 16-byte digest yields the same 32 hex chars the
+    # /api/figures/snippet/{key}.png route accepts, without sha256 + truncation.
+    h = hashlib.blake2b(digest_size=16)
     h.update(body.encode("utf-8"))
     h.update(b"\x00")
     h.update(",".join(pkgs).encode("utf-8"))
     h.update(b"\x00")
     h.update(",".join(libs).encode("utf-8"))
-    return h.hexdigest()[:32]
+    return h.hexdigest()
 
 
 def snippet_png_path(key: str) -> Path:
@@ -194,17 +198,13 @@ def _build_standalone(body: str, pkgs: list[str], libs: list[str]) -> str:
     return "\n".join(lines) + "\n"
 
 
-def _run(cmd: list[str], cwd: str) -> subprocess.CompletedProcess:
+def _run(cmd: list[str], cwd: str, *, discard_output: bool = False) -> subprocess.CompletedProcess:
     # ユーザー由来の tikz/circuitikz snippet を描画するため、fork bomb 等から保護する
     from ..pdf_service import _make_subprocess_limits
-    return subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        timeout=_PREVIEW_TIMEOUT_SEC,
-        cwd=cwd,
-        env=TEX_ENV,
+    return run_tex_tool(
+        cmd, cwd, _PREVIEW_TIMEOUT_SEC,
         preexec_fn=_make_subprocess_limits(),
+        discard_output=discard_output,
     )
 
 
@@ -217,35 +217,38 @@ def _build_png_sync(key: str, body: str, pkgs: list[str], libs: list[str]) -> Pa
     with tempfile.TemporaryDirectory(prefix="figsnip_") as tmpdir:
         tex_path = Path(tmpdir) / "snip.tex"
         pdf_path = Path(tmpdir) / "snip.pdf"
-        tex_path.write_text(tex, encoding="utf-8")
+        tex_path.write_bytes(tex.encode("utf-8"))
 
         result = _run(get_compile_args(LUALATEX_CMD, tmpdir, str(tex_path)), tmpdir)
         if result.returncode != 0 or not pdf_path.exists():
-            tail = (result.stdout + "\n" + result.stderr)[-1500:]
+            tail = decode_log_tail(result.stdout, result.stderr)[-1500:]
             raise SnippetError(f"lualatex failed: {tail}")
 
-        pdfcrop = shutil.which("pdfcrop")
+        pdfcrop = PDFCROP_CMD
         if pdfcrop:
             cropped = Path(tmpdir) / "snip-cropped.pdf"
-            r = _run([pdfcrop, "--margins", "6", str(pdf_path), str(cropped)], tmpdir)
+            r = _run([pdfcrop, "--margins", "6", str(pdf_path), str(cropped)], tmpdir, discard_output=True)
             if r.returncode == 0 and cropped.exists():
                 pdf_path = cropped
 
-        pdftoppm = shutil.which("pdftoppm")
-        if not pdftoppm:
-            raise SnippetError("pdftoppm not available")
-
-        png_prefix = Path(tmpdir) / "page"
-        r = _run(
-            [pdftoppm, "-png", "-r", "180", "-singlefile", str(pdf_path), str(png_prefix)],
-            tmpdir,
-        )
+        # ユーザー由来の PDF は timeout と rlimit の効く pdftoppm で描画する。
+        # PyMuPDF はプロセス内で GIL を握ったまま描くので、重い図でサーバー全体が止まる。
+        # pdftoppm が無い環境だけ、小さいページに限って in-process 描画に頼る。
         png_out = Path(tmpdir) / "page.png"
-        if r.returncode != 0 or not png_out.exists():
-            cands = sorted(Path(tmpdir).glob("page*.png"))
-            if not cands:
-                raise SnippetError(f"pdftoppm failed: {r.stderr[-300:]}")
-            png_out = cands[0]
+        pdftoppm = PDFTOPPM_CMD
+        if pdftoppm:
+            png_prefix = Path(tmpdir) / "page"
+            r = _run(
+                [pdftoppm, "-png", "-r", str(PREVIEW_DPI), "-singlefile", str(pdf_path), str(png_prefix)],
+                tmpdir,
+            )
+            if r.returncode != 0 or not png_out.exists():
+                cands = sorted(Path(tmpdir).glob("page*.png"))
+                if not cands:
+                    raise SnippetError(f"pdftoppm failed: {r.stderr[-300:].decode('utf-8', errors='replace')}")
+                png_out = cands[0]
+        elif not render_first_page_png(pdf_path, png_out):
+            raise SnippetError("pdftoppm not available")
         shutil.copyfile(png_out, out)
 
     return out
@@ -357,7 +360,7 @@ async def compile_snippet(
             )
         return out, key
 
-    async with _snippet_semaphore:
+    async with FIGURE_RENDER_LIMIT:
         if out.exists() and out.stat().st_size > 0:
             if log:
                 _log_attempt(
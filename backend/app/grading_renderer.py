@@ -458,7 +458,7 @@ def _compile_with_images_sync(
             safe_name = Path(filename).name
             (Path(tmpdir) / safe_name).write_bytes(img_bytes)
 
-        tex_path.write_text(latex_source, encoding="utf-8")
+        tex_path.write_bytes(latex_source.encode("utf-8"))
 
         cmd_args = get_compile_args(LUALATEX_CMD, str(tmpdir), str(tex_path))
         from .pdf_service import _make_subprocess_limits
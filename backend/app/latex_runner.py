@@ -0,0 +1,143 @@
+"""
+LaTeX サブプロセス実行の共通部品
+
+pdf_service (本番 PDF) と figures/ (図プレビュー) がそれぞれ持っていた
+「TEX_ENV で起動 → 終了待ち → ログ回収」の処理をここに集約する。
+起動方法やログの扱いを変えるときはこのモジュールだけ直せばよい。
+
+  - run_latex: asyncio サブプロセスで起動し、stdout / stderr の末尾だけを保持
+  - decode_log_tail: 失敗時に必要なログ末尾だけを UTF-8 デコード
+  - run_tex_tool: 図プレビュー用の同期版 (lualatex / pdfcrop / pdftoppm)
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+import signal
+import subprocess
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .tex_env import TEX_ENV
+
+_READ_CHUNK = 64 * 1024
+
+# TeX エンジンを新しいセッション (= プロセスグループ) で起動し、後始末はグループごと kill する。
+# mktex* などの孫プロセスが stdout / stderr を握ったまま残ると、直下の子だけ kill しても
+# パイプが EOF にならず、asyncio の Process.wait() が返らないため。
+_USE_PROCESS_GROUP = hasattr(os, "killpg")
+# kill 後に子の回収とパイプの EOF を待つ上限 (秒)。グループ外へ逃げた子孫がパイプを
+# 握っていてもこれ以上は待たない。
+_REAP_TIMEOUT = 2.0
+
+# decode_log_tail の既定値。lualatex のエラー本文は stdout に出るので stdout 側を厚めに取る。
+LOG_DECODE_STDOUT_BYTES = 16 * 1024
+LOG_DECODE_STDERR_BYTES = 4 * 1024
+
+
+@dataclass(frozen=True)
+class LatexRun:
+    """run_latex の結果。stdout / stderr は capture_limit で切り詰めた末尾"""
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+
+async def _read_tail(stream: asyncio.StreamReader, limit: int, buf: bytearray) -> None:
+    """stream を EOF まで読み、末尾 limit バイトだけを buf に残す (途中で止められても buf は有効)"""
+    while chunk := await stream.read(_READ_CHUNK):
+        buf += chunk
+        if len(buf) > limit:
+            del buf[:-limit]
+
+
+def _kill_process_group(proc: asyncio.subprocess.Process) -> None:
+    """子とその子孫をまとめて SIGKILL する (既に居なければ何もしない)"""
+    if _USE_PROCESS_GROUP:
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(proc.pid, signal.SIGKILL)
+    elif proc.returncode is None:
+        with contextlib.suppress(ProcessLookupError):
+            proc.kill()
+
+
+async def run_latex(
+    cmd_args: list[str],
+    *,
+    cwd: str,
+    timeout: float,
+    capture_limit: int,
+    env: dict[str, str] = TEX_ENV,
+    preexec_fn: Optional[Callable[[], None]] = None,
+) -> LatexRun:
+    """TeX エンジンを起動して終了を待つ。
+
+    コマンドが無ければ FileNotFoundError、timeout 秒を超えたら asyncio.TimeoutError。
+    終了・タイムアウト・呼び出し側のキャンセルのいずれでも、子孫を含むプロセスグループを
+    kill してから抜ける。回収待ちは _REAP_TIMEOUT で打ち切るので、パイプを握ったまま
+    残る子孫がいても timeout は守られる。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd_args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        preexec_fn=preexec_fn,
+        start_new_session=_USE_PROCESS_GROUP,
+    )
+    out_buf, err_buf = bytearray(), bytearray()
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(
+                _read_tail(proc.stdout, capture_limit, out_buf),
+                _read_tail(proc.stderr, capture_limit, err_buf),
+                proc.wait(),
+            ),
+            timeout=timeout,
+        )
+    finally:
+        # 正常終了時も、居残った補助プロセスごと片付ける
+        _kill_process_group(proc)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(proc.wait(), timeout=_REAP_TIMEOUT)
+    return LatexRun(proc.returncode, bytes(out_buf), bytes(err_buf))
+
+
+def decode_log_tail(
+    stdout: bytes,
+    stderr: bytes,
+    stdout_limit: int = LOG_DECODE_STDOUT_BYTES,
+    stderr_limit: int = LOG_DECODE_STDERR_BYTES,
+) -> str:
+    """stdout / stderr の末尾だけを連結して UTF-8 デコードする (不正バイトは置換)"""
+    return (stdout[-stdout_limit:] + b"\n" + stderr[-stderr_limit:]).decode("utf-8", errors="replace")
+
+
+def run_tex_tool(
+    cmd: list[str],
+    cwd: str,
+    timeout: float,
+    *,
+    env: dict[str, str] = TEX_ENV,
+    preexec_fn: Optional[Callable[[], None]] = None,
+    discard_output: bool = False,
+) -> subprocess.CompletedProcess:
+    """同期版: 図プレビューの lualatex / pdfcrop / pdftoppm 呼び出し用
+
+    stdout / stderr は bytes のまま返す。失敗時に要るのは末尾だけなので、
+    呼び出し側は decode_log_tail などで末尾だけをデコードすること。
+    discard_output=True なら出力を /dev/null に直結し、パイプも読み取りも作らない
+    (returncode だけを見る pdfcrop 向け。stdout / stderr は None になる)。
+    """
+    sink = subprocess.DEVNULL if discard_output else subprocess.PIPE
+    return subprocess.run(
+        cmd,
+        stdout=sink,
+        stderr=sink,
+        timeout=timeout,
+        cwd=cwd,
+        env=env,
+        preexec_fn=preexec_fn,
+    )
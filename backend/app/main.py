@@ -19,9 +19,14 @@ from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Req
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response, JSONResponse, StreamingResponse, FileResponse
 from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
 
 from .models import DocumentModel, ErrorResponse, BatchRequest, BatchResponse, BatchResultItem
-from .pdf_service import compile_pdf, compile_raw_latex, generate_latex, PDFGenerationError
+from .pdf_service import (
+    compile_pdf, compile_pdf_file, compile_raw_latex, generate_latex,
+    release_pdf_file, set_max_concurrent, get_compile_concurrency,
+    PDFGenerationError,
+)
 from .security import (
     validate_latex_security, validate_latex_size,
     SecurityViolation, ALLOWED_PACKAGES, ALLOWED_TIKZ_LIBRARIES,
@@ -363,9 +368,23 @@ async def warmup_status(_admin: User = Depends(require_admin)):
         "compile_tested": {
             "lualatex": LUALATEX_JA_OK,
         },
+        "compile_concurrency": get_compile_concurrency(),
     }
 
 
+@app.post("/api/debug/max-concurrent")
+async def update_max_concurrent(
+    n: int,
+    _admin: User = Depends(require_admin),
+):
+    """同時コンパイル数の上限を再起動なしで変更する (メモリ逼迫時の絞り込み用)"""
+    try:
+        await set_max_concurrent(n)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "compile_concurrency": get_compile_concurrency()}
+
+
 @app.post("/api/preview-latex")
 async def preview_latex(
     doc: DocumentModel,
@@ -395,10 +414,11 @@ async def generate_pdf(
     user: User = Depends(enforce_pdf_quota),
     db: Session = Depends(get_db),
 ):
-    """PDF生成エンドポイント — DocumentModel.latex をコンパイルしてPDFバイトを返す。
+    """PDF生成エンドポイント — DocumentModel.latex をコンパイルしてPDFを返す。
 
     認証必須。プランの月間PDF出力上限を超えている場合は 429。
     コンパイル成功後に `pdf_export` を UsageLog に記録する。
+    PDF はキャッシュ上のファイルから FileResponse で直接送出する (bytes コピーなし)。
     """
     enforce_rate_limit(request, "generate-pdf", limit=30, window_seconds=60)
     if not (doc.latex or "").strip():
@@ -408,7 +428,7 @@ async def generate_pdf(
         })
 
     try:
-        pdf_bytes = await compile_pdf(doc)
+        pdf_path = await compile_pdf_file(doc)
     except PDFGenerationError as e:
         logger.error(f"PDF generation failed: {e.detail}")
         raise HTTPException(status_code=422, detail={
@@ -427,20 +447,27 @@ async def generate_pdf(
             "message": "予期しないエラーが発生しました。しばらく待ってからもう一度お試しください。",
         })
 
-    log_usage(db, user.id, "pdf_export")
+    # pdf_path は送出専用のファイル。FileResponse に渡す前に失敗したら
+    # BackgroundTask が走らないので、ここで消してから投げ直す
+    try:
+        log_usage(db, user.id, "pdf_export")
 
-    filename = (doc.metadata.title or "document").replace(" ", "_") + ".pdf"
+        filename = (doc.metadata.title or "document").replace(" ", "_") + ".pdf"
 
-    from urllib.parse import quote
-    safe_filename = quote(filename, safe="")
+        from urllib.parse import quote
+        safe_filename = quote(filename, safe="")
 
-    return Response(
-        content=pdf_bytes,
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename*=UTF-8''{safe_filename}",
-        },
-    )
+        return FileResponse(
+            pdf_path,
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": f"attachment; filename*=UTF-8''{safe_filename}",
+            },
+            background=BackgroundTask(release_pdf_file, pdf_path),
+        )
+    except BaseException:
+        release_pdf_file(pdf_path)
+        raise
 
 
 # ═══ 匿名ゲスト用エンドポイント (ログインなし無料お試し) ═══
@@ -666,7 +666,7 @@ def _pdf_extract_poppler(pdf_bytes: bytes, max_pages: int = 10) -> dict:
                 "-l", str(pages_to_process),
                 pdf_path, os.path.join(tmpdir, "page"),
             ],
-            capture_output=True, timeout=90,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=90,
             check=True,
         )
 
@@ -9,35 +9,64 @@ PDF生成サービス: raw LaTeX → LuaLaTeX コンパイル → PDF返却
   - Koyeb Free (512MB) 同時コンパイル=1
 """
 import asyncio
+import contextlib
+import enum
 import gc
+import hashlib
 import os
+import queue
 import re
 import shutil
-import subprocess
 import tempfile
 import logging
+import platform
+import signal
 import time
 from pathlib import Path
 
+try:
+    import resource
+except ImportError:  # Windows には resource モジュールが無い
+    resource = None
+
 from .models import DocumentModel
 from .tex_env import (
-    TEX_ENV, LUALATEX_CMD,
-    wait_for_warmup,
+    TEX_ENV, LUALATEX_CMD, DEFAULT_ENGINE, FALLBACK_ENGINES,
+    ENGINE_CMD, ENGINE_AVAILABLE,
+    wait_for_warmup, is_warmup_done,
 )
 from .security import (
     validate_latex_security, validate_latex_size,
     get_compile_args, format_violations,
 )
 from .cache_service import (
-    get_cached_pdf, store_cached_pdf,
+    get_cached_pdf, get_cached_pdf_path, link_pdf_for_serving, pdf_cache_path,
+    store_cached_pdf, write_pdf_for_serving,
 )
+from .latex_runner import run_latex, decode_log_tail
 from .audit import log_compile_event, log_security_event, AuditEvent
-from .latex_autofix import autofix_latex, autofix_after_failure
+from .latex_autofix import autofix_latex, autofix_after_failure, _unwrap_tex_log
 
 logger = logging.getLogger(__name__)
 
+# 起動時に存在確認済みのエンジンだけを試行順に並べておく (リクエストごとに再確認しない)
+_VIABLE_ENGINES: list[tuple[str, str]] = [
+    (name, ENGINE_CMD[name])
+    for name in [DEFAULT_ENGINE, *FALLBACK_ENGINES]
+    if ENGINE_AVAILABLE.get(name)
+]
+logger.info(f"[compile] viable engines: {[name for name, _ in _VIABLE_ENGINES] or 'none'}")
+
+# ru_maxrss の単位は Linux では KB、macOS では bytes
+_IS_LINUX = platform.system() == "Linux"
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
 MAX_CONCURRENT = int(os.environ.get("MAX_CONCURRENT_COMPILES", "1"))
-_compile_semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+# 同時コンパイル数のアドミッション制御。Semaphore と違い上限を実行中に
+# 変更できる (set_max_concurrent)。メモリ逼迫時に運用側から絞るため。
+_admit_cv = asyncio.Condition()
+_inflight = 0
+_max_inflight = MAX_CONCURRENT
 # コンパイル timeout の既定は 180 秒。以前 90 秒に絞ったところ、LuaLaTeX の
 # 初回コールドスタート (font cache 生成) や luatexja の大型フォント読み込みで
 # 合法なコンパイルまで落ちるケースが出たので戻した。
@@ -45,6 +74,19 @@ _compile_semaphore = asyncio.Semaphore(MAX_CONCURRENT)
 COMPILE_TIMEOUT = int(os.environ.get("COMPILE_TIMEOUT_SECONDS", "180"))
 # subprocess が書ける最大ファイルサイズ (bytes)。巨大 PDF 生成を防ぐ。
 COMPILE_FILE_SIZE_LIMIT_BYTES = int(os.environ.get("COMPILE_FILE_SIZE_LIMIT_BYTES", str(50 * 1024 * 1024)))
+# subprocess のデータ領域 (heap + 私有の書き込み可能 mapping) 上限 (MB)。0 なら無制限。
+# RLIMIT_AS と違い mmap したフォントや .fmt は数えないので luatexja を落とさない。
+COMPILE_DATA_LIMIT_MB = int(os.environ.get("COMPILE_DATA_LIMIT_MB", "0"))
+# lualatex の stdout / stderr はそれぞれ末尾このバイト数だけ保持する。
+# エラー解析 (_parse_latex_error / autofix) に要るのはログ末尾なので、
+# 暴走して大量の警告を吐く入力でもメモリとデコード量が増えない。
+COMPILE_LOG_CAPTURE_BYTES = int(os.environ.get("COMPILE_LOG_CAPTURE_BYTES", str(256 * 1024)))
+# 現在の RSS がこれを超えたときだけ明示的に full GC する (512MB 枠の 8 割弱)。
+GC_RSS_THRESHOLD_MB = int(os.environ.get("GC_RSS_THRESHOLD_MB", "400"))
+# コンパイル作業ディレクトリを置く親ディレクトリ。空なら tempfile の既定 (/tmp 等)。
+# /dev/shm (tmpfs) を指定すると .aux / .log / .pdf の読み書きがディスクを経由しないが、
+# 書いた分だけコンテナのメモリ枠を食うので既定では使わない (余裕のある環境向け)。
+COMPILE_WORK_DIR = os.environ.get("COMPILE_WORK_DIR", "").strip() or None
 
 
 def _make_subprocess_limits():
@@ -53,6 +95,7 @@ def _make_subprocess_limits():
     - RLIMIT_CPU: wallclock timeout と同等の CPU 時間上限 (fork bomb 対策)
     - RLIMIT_FSIZE: 書き込みファイルサイズ上限 (出力 PDF 肥大化対策)
     - RLIMIT_CORE: コアダンプ無効化
+    - RLIMIT_DATA: COMPILE_DATA_LIMIT_MB > 0 のときだけ heap 上限 (任意)
 
     注意: 以前は RLIMIT_AS (仮想メモリ) と RLIMIT_NPROC を含めていたが、
       ・luatexja + Harano Aji フォントは mmap で大量の仮想アドレス空間を
@@ -60,18 +103,19 @@ def _make_subprocess_limits():
       ・lualatex はヘルパ (mkindex, pdftex など) を fork することがあり
         NPROC 絞りで予期せぬ失敗を起こす
     実質的なメモリ制限はコンテナ (Koyeb / Docker cgroup) で行う方針とし、
-    ここでは CPU と書き込みサイズ、コアダンプのみ縛る。
+    ここでは CPU と書き込みサイズ、コアダンプのみ縛る。プロセス単位でも
+    メモリを縛りたい場合は RLIMIT_AS ではなく RLIMIT_DATA (Linux 4.7+ では
+    ファイル由来の mmap を含まない) を COMPILE_DATA_LIMIT_MB で有効にする。
 
     Windows (resource モジュール非対応) では None を返してスキップする。
     """
-    try:
-        import resource
-    except ImportError:
+    if resource is None:
         return None
 
     # CPU は timeout + 余裕 30秒。短すぎると cold start で落ちる。
     cpu_limit = max(COMPILE_TIMEOUT + 30, 60)
     fsize_limit = COMPILE_FILE_SIZE_LIMIT_BYTES
+    data_limit = COMPILE_DATA_LIMIT_MB * 1024 * 1024
 
     def _preexec():
         # 各 setrlimit は (soft, hard) のタプル。
@@ -87,22 +131,45 @@ def _make_subprocess_limits():
             resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
         except (ValueError, OSError):
             pass
+        if data_limit > 0:
+            try:
+                resource.setrlimit(resource.RLIMIT_DATA, (data_limit, data_limit))
+            except (ValueError, OSError):
+                pass
 
     return _preexec
 
 
-def _log_memory(label: str) -> None:
+def _rss_mb() -> float:
+    """現在の RSS (MB)。Linux は /proc/self/statm、それ以外は ru_maxrss (ピーク値) で代用"""
     try:
-        import resource
-        import platform
-        usage = resource.getrusage(resource.RUSAGE_SELF)
-        maxrss = usage.ru_maxrss
-        if platform.system() == "Linux":
-            maxrss *= 1024
-        rss_mb = maxrss / (1024 * 1024)
-        logger.info(f"[memory:{label}] RSS={rss_mb:.1f}MB")
-    except Exception:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
         pass
+    if resource is None:
+        return 0.0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if _IS_LINUX:
+        maxrss *= 1024
+    return maxrss / (1024 * 1024)
+
+
+def _maybe_gc() -> None:
+    """メモリが逼迫しているときだけ full GC する。
+
+    毎コンパイルの gc.collect() は生存オブジェクト全体を走査するだけで、
+    メモリに余裕があるときは何も回収しない。通常は CPython の世代別 GC に任せる。
+    """
+    if gc.get_count()[2] > 10 or _rss_mb() > GC_RSS_THRESHOLD_MB:
+        gc.collect()
+
+
+def _log_memory(label: str) -> None:
+    """_maybe_gc と同じ _rss_mb() の値を出す (ピークではなく現在の RSS)"""
+    rss_mb = _rss_mb()
+    if rss_mb:
+        logger.info(f"[memory:{label}] RSS={rss_mb:.1f}MB")
 
 
 class PDFGenerationError(Exception):
@@ -137,22 +204,50 @@ def generate_latex(doc: DocumentModel) -> str:
 
 async def compile_pdf(doc: DocumentModel) -> bytes:
     """raw LaTeX → LuaLaTeX コンパイル → PDFバイト列"""
-    async with _compile_semaphore:
-        return await asyncio.get_event_loop().run_in_executor(
-            None, _compile_pdf_sync, doc
-        )
+    async with _compile_admission():
+        return await _compile_pdf(doc)
 
 
-def _compile_pdf_sync(doc: DocumentModel) -> bytes:
-    """同期版 PDF 生成 — LuaLaTeX 一本"""
-    t0 = time.monotonic()
+@contextlib.asynccontextmanager
+async def _compile_admission():
+    """実行中のコンパイル数が上限未満になるまで待ってから 1 枠確保する"""
+    global _inflight
+    async with _admit_cv:
+        await _admit_cv.wait_for(lambda: _inflight < _max_inflight)
+        _inflight += 1
+    try:
+        yield
+    finally:
+        async with _admit_cv:
+            _inflight -= 1
+            # notify(1) だと起こした 1 件が同じ tick でキャンセルされたとき起床が失われ、
+            # 枠が空いたまま後続が永久に待つ。wait_for が条件を再確認するので全員起こす。
+            _admit_cv.notify_all()
+
+
+async def set_max_concurrent(n: int) -> None:
+    """同時コンパイル数の上限を変更する。実行中のコンパイルは中断しない。"""
+    global _max_inflight
+    if n < 1:
+        raise ValueError("max concurrent compiles must be >= 1")
+    async with _admit_cv:
+        _max_inflight = n
+        _admit_cv.notify_all()
 
-    latex_source = doc.latex or ""
 
+def get_compile_concurrency() -> dict[str, int]:
+    return {"inflight": _inflight, "max": _max_inflight}
+
+
+def _validate_latex_source(latex_source: str) -> None:
+    """サイズ上限と危険コマンドを検査する。違反時は PDFGenerationError。
+
+    compile_pdf / compile_raw_latex の両経路で同じ検査を共有する。
+    """
     # 入力サイズ制限
     size_error = validate_latex_size(latex_source)
     if size_error:
-        raise PDFGenerationError(size_error)
+        raise PDFGenerationError(size_error, code="latex_too_large")
 
     # 危険コマンド検査
     violations = validate_latex_security(latex_source)
@@ -167,42 +262,131 @@ def _compile_pdf_sync(doc: DocumentModel) -> bytes:
             violations=violations,
         )
 
+
+async def compile_pdf_file(doc: DocumentModel) -> Path:
+    """compile_pdf のファイル版 — PDF を bytes ではなくディスク上のパスで返す。
+
+    成功した PDF は PDF キャッシュに保存され、そのファイルへのハードリンク
+    (送出専用のパス) を返す。HTTP 層は FileResponse でディスクから直接送出でき、
+    数 MB の PDF を bytes としてメモリに載せずに済む。キャッシュ側が TTL や
+    LRU で元ファイルを消しても送出中のリンクは残る。送出後は必ず
+    release_pdf_file() を呼ぶこと。
+    """
+    async with _compile_admission():
+        return await _compile_pdf_file(doc)
+
+
+def release_pdf_file(pdf_path: Path) -> None:
+    """compile_pdf_file() が返したパスを後始末する (キャッシュ本体は残る)。"""
+    pdf_path.unlink(missing_ok=True)
+
+
+def _document_cache_key(doc: DocumentModel) -> str:
+    """PDF キャッシュキー。
+
+    pydantic-core (Rust) の model_dump_json 出力をそのまま BLAKE2b に通す。
+    フィールド順はモデル定義順で固定なので sort_keys 付きの json.dumps は不要。
+    """
+    return hashlib.blake2b(doc.model_dump_json().encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _log_cache_hit(doc: DocumentModel, t0: float, pdf_size: int) -> None:
+    elapsed = time.monotonic() - t0
+    log_compile_event(
+        AuditEvent.COMPILE_PDF,
+        template=doc.template,
+        compile_time_ms=elapsed * 1000,
+        cache_hit=True,
+        pdf_size=pdf_size,
+    )
+
+
+async def _compile_pdf(doc: DocumentModel) -> bytes:
+    """PDF 生成本体 — LuaLaTeX 一本"""
+    t0 = time.monotonic()
+
+    latex_source = doc.latex or ""
+    await asyncio.to_thread(_validate_latex_source, latex_source)
+
     # PDFキャッシュチェック
-    doc_dict = doc.model_dump(by_alias=False)
-    cached_pdf = get_cached_pdf(doc_dict)
+    cache_key = _document_cache_key(doc)
+    cached_pdf = await asyncio.to_thread(get_cached_pdf, cache_key)
     if cached_pdf:
-        elapsed = time.monotonic() - t0
-        log_compile_event(
-            AuditEvent.COMPILE_PDF,
-            template=doc.template,
-            compile_time_ms=elapsed * 1000,
-            cache_hit=True,
-            pdf_size=len(cached_pdf),
-        )
+        _log_cache_hit(doc, t0, len(cached_pdf))
         return cached_pdf
 
-    gc.collect()
+    return await _compile_and_store(doc, latex_source, cache_key, t0)
+
+
+async def _compile_pdf_file(doc: DocumentModel) -> Path:
+    """compile_pdf_file 本体 — キャッシュ済みならファイルを読まずにパスだけ返す"""
+    t0 = time.monotonic()
+
+    latex_source = doc.latex or ""
+    await asyncio.to_thread(_validate_latex_source, latex_source)
+
+    cache_key = _document_cache_key(doc)
+    served_path = await asyncio.to_thread(_checkout_cached_pdf, cache_key)
+    if served_path is not None:
+        _log_cache_hit(doc, t0, served_path.stat().st_size)
+        return served_path
+
+    pdf = await _compile_and_store(doc, latex_source, cache_key, t0)
+    return await asyncio.to_thread(_serve_compiled_pdf, cache_key, pdf)
+
+
+def _checkout_cached_pdf(cache_key: str) -> Path | None:
+    """キャッシュヒットなら送出用のリンクを返す。
+
+    判定後に追い出された場合も None になり、通常のミスとして再コンパイルする。
+    """
+    cached_path = get_cached_pdf_path(cache_key)
+    if cached_path is None:
+        return None
+    return link_pdf_for_serving(cached_path)
+
+
+def _serve_compiled_pdf(cache_key: str, pdf: bytes) -> Path:
+    """コンパイル直後の PDF の送出用パスを返す"""
+    served_path = link_pdf_for_serving(pdf_cache_path(cache_key))
+    if served_path is not None:
+        return served_path
+
+    # キャッシュ書き込みに失敗した (または直後に追い出された) 場合は送出用ファイルへ直接書く
+    return write_pdf_for_serving(cache_key, pdf)
+
+
+async def _compile_and_store(
+    doc: DocumentModel,
+    latex_source: str,
+    cache_key: str,
+    t0: float,
+) -> bytes:
+    """キャッシュミス時の本体: コンパイルして PDF キャッシュに保存する"""
+    _maybe_gc()
     _log_memory("pre-compile")
 
-    wait_for_warmup(timeout=2.0)
+    if not is_warmup_done():
+        # wait_for_warmup はブロッキング待ちなのでイベントループを止めないようスレッドで待つ
+        await asyncio.to_thread(wait_for_warmup, 2.0)
 
-    cmd_exists = bool(shutil.which(LUALATEX_CMD) or Path(LUALATEX_CMD).is_file())
-    if not cmd_exists:
+    if not _VIABLE_ENGINES:
         raise PDFGenerationError(
             "LuaLaTeX エンジンがシステムに見つかりません。",
             detail=f"{LUALATEX_CMD} not found in PATH"
         )
+    engine_name, engine_cmd = _VIABLE_ENGINES[0]
 
     timeout = COMPILE_TIMEOUT
-    logger.info(f"[compile] lualatex (timeout={timeout}s)")
+    logger.info(f"[compile] {engine_name} (timeout={timeout}s)")
 
     try:
-        pdf = _compile_latex(latex_source, timeout=timeout)
+        pdf = await _compile_latex(latex_source, timeout=timeout, engine_cmd=engine_cmd)
         elapsed = time.monotonic() - t0
         logger.info(f"[compile] PDF generated with lualatex ({elapsed:.1f}s)")
         _log_memory("post-compile")
 
-        store_cached_pdf(doc_dict, pdf)
+        await asyncio.to_thread(store_cached_pdf, cache_key, pdf)
 
         log_compile_event(
             AuditEvent.COMPILE_PDF,
@@ -226,13 +410,19 @@ def _compile_pdf_sync(doc: DocumentModel) -> bytes:
             detail=str(e),
         )
     finally:
-        gc.collect()
+        _maybe_gc()
 
 
 _AUTOFIX_MAX_ROUNDS = int(os.environ.get("LATEX_AUTOFIX_MAX_ROUNDS", "3"))
 
 
-def _compile_latex(latex_source: str, timeout: int = 120) -> bytes:
+async def _compile_latex(
+    latex_source: str,
+    timeout: int = 120,
+    *,
+    engine_cmd: str = LUALATEX_CMD,
+    env: dict[str, str] = TEX_ENV,
+) -> bytes:
     """LuaLaTeX でコンパイルしPDFバイト列を返す。
 
     AI 出力や手書き LaTeX の細かいミスを救うため、ここでは
@@ -244,25 +434,32 @@ def _compile_latex(latex_source: str, timeout: int = 120) -> bytes:
     各ラウンドで autofix_after_failure が「変化なし」を返した場合は早期に打ち切る
     (同じ修復を何度も試しても無意味なため)。
     """
+    # autofix / ログ解析は入力長に比例する CPU 処理 (1MB 近い入力で数秒) なので、
+    # イベントループを止めないようスレッドで回す。await するのは lualatex の実行だけ。
+
     # 1) コンパイル前サニタイズ
-    fixed_source = autofix_latex(latex_source)
+    fixed_source = await asyncio.to_thread(autofix_latex, latex_source)
 
-    pdf_bytes, log_output = _try_compile_once(fixed_source, timeout)
+    pdf_bytes, log_output = await _try_compile_once(
+        fixed_source, timeout, engine_cmd=engine_cmd, env=env,
+    )
     if pdf_bytes is not None:
-        gc.collect()
+        _maybe_gc()
         return pdf_bytes
 
     # 2) 失敗ログから不足パッケージ / stub を補ってリトライ — 最大 N 回
     current_source = fixed_source
     for round_idx in range(1, _AUTOFIX_MAX_ROUNDS + 1):
-        retried_source = autofix_after_failure(current_source, log_output or "")
+        retried_source = await asyncio.to_thread(autofix_after_failure, current_source, log_output or "")
         if not retried_source or retried_source == current_source:
             break
         logger.info(f"[autofix] retry round {round_idx}/{_AUTOFIX_MAX_ROUNDS}")
-        retry_pdf, retry_log = _try_compile_once(retried_source, timeout)
+        retry_pdf, retry_log = await _try_compile_once(
+            retried_source, timeout, engine_cmd=engine_cmd, env=env,
+        )
         if retry_pdf is not None:
             logger.info(f"[autofix] recovered after round {round_idx}")
-            gc.collect()
+            _maybe_gc()
             return retry_pdf
         # 次のラウンドに向けてソースとログを更新
         current_source = retried_source
@@ -273,22 +470,27 @@ def _compile_latex(latex_source: str, timeout: int = 120) -> bytes:
     # エラーがあっても出力可能な範囲で PDF を生成する。
     # tikzpicture のライブラリ不足等で後続テキストが消える問題を緩和する。
     logger.info("[autofix] strict retries exhausted — trying lenient compile")
-    lenient_pdf, lenient_log = _try_compile_once(current_source, timeout, lenient=True)
+    lenient_pdf, lenient_log = await _try_compile_once(
+        current_source, timeout, lenient=True, engine_cmd=engine_cmd, env=env,
+    )
     if lenient_pdf is not None:
         logger.info("[autofix] lenient compile produced a PDF despite errors")
-        gc.collect()
+        _maybe_gc()
         return lenient_pdf
 
     # ここまで来たら救えない — 元のエラー扱いで投げ直す
-    user_msg = _parse_latex_error(lenient_log or log_output or "")
-    raise PDFGenerationError(user_msg, detail=(lenient_log or log_output or "")[-2000:])
+    final_log = lenient_log or log_output or ""
+    message = await asyncio.to_thread(_parse_latex_error, final_log)
+    raise PDFGenerationError(message, detail=final_log[-2000:])
 
 
-def _try_compile_once(
+async def _try_compile_once(
     latex_source: str,
     timeout: int,
     *,
     lenient: bool = False,
+    engine_cmd: str = LUALATEX_CMD,
+    env: dict[str, str] = TEX_ENV,
 ) -> tuple[bytes | None, str | None]:
     """1 回だけ lualatex を呼ぶ。成功なら (bytes, None)、失敗なら (None, log)。
 
@@ -297,32 +499,30 @@ def _try_compile_once(
 
     lenient=True の場合、--halt-on-error を外して -interaction=nonstopmode のみで
     コンパイルする。エラーがあっても出力可能な範囲で PDF を生成する (プレビュー向け)。
+
+    lualatex の起動と終了待ちは latex_runner.run_latex (asyncio サブプロセス) に任せる
+    (待ち時間のためだけに executor スレッドを 1 本占有しない)。
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tex_path = Path(tmpdir) / "document.tex"
-        pdf_path = Path(tmpdir) / "document.pdf"
+    async with _work_slot() as tmpdir:
+        tex_path = os.path.join(tmpdir, "document.tex")
+        pdf_path = os.path.join(tmpdir, "document.pdf")
 
-        tex_path.write_text(latex_source, encoding="utf-8")
+        await asyncio.to_thread(_write_tex_source, tex_path, latex_source)
         logger.info("Compiling with lualatex...%s", " (lenient)" if lenient else "")
 
-        cmd_args = get_compile_args(
-            LUALATEX_CMD,
-            str(tmpdir),
-            str(tex_path),
-        )
+        cmd_args = get_compile_args(engine_cmd, tmpdir, tex_path)
         if lenient:
             # Remove --halt-on-error so compilation continues past errors,
             # producing a partial PDF that still shows compilable content.
             cmd_args = [a for a in cmd_args if a != "-halt-on-error"]
 
         try:
-            result = subprocess.run(
+            run = await run_latex(
                 cmd_args,
-                capture_output=True,
-                text=True,
-                timeout=timeout,
                 cwd=tmpdir,
-                env=TEX_ENV,
+                timeout=timeout,
+                capture_limit=COMPILE_LOG_CAPTURE_BYTES,
+                env=env,
                 preexec_fn=_make_subprocess_limits(),
             )
         except FileNotFoundError:
@@ -330,73 +530,145 @@ def _try_compile_once(
                 "LuaLaTeX エンジンが見つかりません。",
                 detail="lualatex command not found"
             )
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
             raise PDFGenerationError(
                 "PDF生成に時間がかかりすぎました。内容を短くして再度お試しください。",
                 detail=f"lualatex compilation timeout ({timeout}s)"
             )
+        returncode = run.returncode
 
-        if result.returncode != 0:
-            log_output = result.stdout + "\n" + result.stderr
-
-            if result.returncode < 0:
-                import signal as _signal
+        if returncode != 0:
+            if returncode < 0:
                 try:
-                    sig_name = _signal.Signals(-result.returncode).name
+                    sig_name = signal.Signals(-returncode).name
                 except (ValueError, AttributeError):
-                    sig_name = str(-result.returncode)
+                    sig_name = str(-returncode)
                 raise PDFGenerationError(
                     f"PDF生成プロセスが強制終了されました (signal: {sig_name})。メモリ不足の可能性があります。",
-                    detail=f"Process killed by {sig_name}. Log: {log_output[-1000:]}"
+                    detail=f"Process killed by {sig_name}. Log: {decode_log_tail(run.stdout, run.stderr, 1000, 1000)[-1000:]}"
                 )
 
             # In lenient mode, even if returncode != 0, a partial PDF may exist.
             # Return it so the preview shows whatever content compiled successfully.
-            if lenient and pdf_path.exists():
-                logger.warning(
-                    "lualatex exited with errors (exit=%d) but produced a PDF in lenient mode",
-                    result.returncode,
-                )
-                return pdf_path.read_bytes(), None
-
-            logger.error(f"lualatex failed (exit={result.returncode}):\n{log_output[-3000:]}")
+            if lenient:
+                pdf_bytes = await asyncio.to_thread(_read_output_pdf, pdf_path)
+                if pdf_bytes is not None:
+                    logger.warning(
+                        "lualatex exited with errors (exit=%d) but produced a PDF in lenient mode",
+                        returncode,
+                    )
+                    return pdf_bytes, None
+
+            # エラー解析と autofix が見るのはログ末尾なので、デコードはその分だけ
+            log_output = decode_log_tail(run.stdout, run.stderr)
+            logger.error(f"lualatex failed (exit={returncode}):\n{log_output[-3000:]}")
             return None, log_output
 
-        if not pdf_path.exists():
+        pdf_bytes = await asyncio.to_thread(_read_output_pdf, pdf_path)
+        if pdf_bytes is None:
             raise PDFGenerationError(
                 "PDFファイルの生成に失敗しました。",
                 detail="PDF not found after lualatex compilation"
             )
 
-        return pdf_path.read_bytes(), None
+        return pdf_bytes, None
+
+
+# ── 作業ディレクトリのスロットプール ──
+# コンパイルごとに TemporaryDirectory を作って rmtree するのをやめ、
+# MAX_CONCURRENT 個の作業ディレクトリを使い回す。スロット名は mkdtemp の
+# "tmpXXXX" 形式のままなので _strip_temp_paths のパス除去はそのまま効く。
+def _make_work_root() -> tempfile.TemporaryDirectory:
+    if COMPILE_WORK_DIR:
+        try:
+            return tempfile.TemporaryDirectory(prefix="latex-gui-work-", dir=COMPILE_WORK_DIR)
+        except OSError as e:
+            logger.warning("COMPILE_WORK_DIR=%s is not usable (%s); falling back to default tempdir", COMPILE_WORK_DIR, e)
+    return tempfile.TemporaryDirectory(prefix="latex-gui-work-")
+
+
+_WORK_ROOT = _make_work_root()
+_FREE_SLOTS: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+for _ in range(max(1, MAX_CONCURRENT)):
+    _FREE_SLOTS.put(tempfile.mkdtemp(dir=_WORK_ROOT.name))
+
+
+def _clear_slot(slot: str) -> None:
+    """前回のコンパイルの .aux / .log / .pdf などを消して空に戻す"""
+    with os.scandir(slot) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(entry.path)
+
+
+def _release_slot(slot: str) -> None:
+    """スロットを空に戻してプールへ返す"""
+    try:
+        _clear_slot(slot)
+    except OSError as e:
+        # 掃除できないスロットは捨てる (次回は新しく作られる)
+        logger.warning(f"[compile] failed to clear work dir {slot}: {e}")
+    else:
+        _FREE_SLOTS.put(slot)
+
+
+@contextlib.asynccontextmanager
+async def _work_slot():
+    """空の作業ディレクトリを 1 つ借りる。
+
+    通常は _compile_admission で同時実行数が抑えられているが、上限を引き上げた
+    直後などで空きが無い場合は新しいスロットを作って待たずに進む。
+    後片付け (前回の出力の削除) はスレッドで行い、キャンセルされても
+    shield で最後まで走らせてスロットをプールへ戻す。
+    """
+    try:
+        slot = _FREE_SLOTS.get_nowait()
+    except queue.Empty:
+        slot = tempfile.mkdtemp(dir=_WORK_ROOT.name)
+    # tmp 掃除などでディレクトリごと消えていた場合に備える
+    os.makedirs(slot, exist_ok=True)
+    try:
+        yield slot
+    finally:
+        await asyncio.shield(asyncio.to_thread(_release_slot, slot))
+
+
+def _write_tex_source(path: str, latex_source: str) -> None:
+    """TeX ソースを生の fd 書き込みで置く (Path / io ラッパーを経由しない)"""
+    data = memoryview(latex_source.encode("utf-8"))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+
+def _read_output_pdf(path: str) -> bytes | None:
+    """出力 PDF を読む。無ければ None (exists() で stat してから開き直さない)"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
 
 
 async def compile_raw_latex(latex_source: str) -> bytes:
     """生のLaTeXソースをそのままコンパイルしてPDFバイト列を返す"""
-    async with _compile_semaphore:
-        return await asyncio.get_event_loop().run_in_executor(
-            None, _compile_raw_latex_sync, latex_source
-        )
+    async with _compile_admission():
+        return await _compile_raw_latex(latex_source)
 
 
-def _compile_raw_latex_sync(latex_source: str) -> bytes:
-    """同期版: 生LaTeXソースをコンパイル"""
-    size_error = validate_latex_size(latex_source)
-    if size_error:
-        raise PDFGenerationError(size_error, code="latex_too_large")
-    violations = validate_latex_security(latex_source)
-    if violations:
-        log_security_event(violations, action="blocked")
-        raise PDFGenerationError(
-            f"Security policy violation: {format_violations(violations, lang='en')}",
-            detail=str(violations),
-            code="security_violation",
-            violations=violations,
-        )
-    gc.collect()
+async def _compile_raw_latex(latex_source: str) -> bytes:
+    """compile_raw_latex 本体: 生LaTeXソースをコンパイル"""
+    await asyncio.to_thread(_validate_latex_source, latex_source)
+    _maybe_gc()
     timeout = COMPILE_TIMEOUT
-    pdf = _compile_latex(latex_source, timeout=timeout)
-    gc.collect()
+    pdf = await _compile_latex(latex_source, timeout=timeout)
+    _maybe_gc()
     return pdf
 
 
@@ -485,6 +757,84 @@ def _extract_undefined_environment_name(log: str) -> str | None:
     return m.group(1) if m else None
 
 
+class _ErrBits(enum.IntFlag):
+    """_parse_latex_error が参照するログ中キーワードのビットマップ"""
+    UNDEF_CS = enum.auto()        # undefined control sequence
+    UNDEFINED = enum.auto()       # undefined
+    ENVIRONMENT = enum.auto()     # environment
+    MISSING_DOLLAR = enum.auto()  # missing $ inserted
+    ALIGN = enum.auto()           # extra alignment tab / misplaced alignment
+    MISSING_BRACE = enum.auto()   # missing } inserted / missing { inserted
+    RUNAWAY = enum.auto()         # runaway argument
+    PAR_ENDED = enum.auto()       # paragraph ended before
+    FILE_NOT_FOUND = enum.auto()  # file not found
+    FILE = enum.auto()            # file
+    NOT_FOUND = enum.auto()       # not found
+    IMAGE = enum.auto()           # image
+    LUATEXJA = enum.auto()        # luatexja
+    FONTSPEC_ERROR = enum.auto()  # fontspec error
+    FONTSPEC = enum.auto()        # fontspec
+    EMERGENCY = enum.auto()       # emergency stop
+
+
+# エラー分類ごとの名前付きグループ → 立てるビット。長いキーワードが短いキーワードを
+# 内包する場合 (例: "file not found" ⊃ "file", "not found") は内包される側のビットも
+# 立てる。同じ位置では先に書いた (長い) 方が優先されるよう、内包する側を前に並べる。
+# 各グループはゼロ幅の先読み (?=...) で包み、マッチが文字を消費しないようにする。
+# 消費すると "filemergency stop" のように直前のキーワードと重なる語を取りこぼす
+# (_unwrap_tex_log は折り返し行を区切りなしで連結するので実際に起こる)。
+_ERR_GROUPS: tuple[tuple[str, str, _ErrBits], ...] = (
+    ("undef_cs", r"undefined control sequence", _ErrBits.UNDEF_CS | _ErrBits.UNDEFINED),
+    ("par_ended", r"paragraph ended before", _ErrBits.PAR_ENDED),
+    ("align", r"extra alignment tab|misplaced alignment", _ErrBits.ALIGN),
+    ("missing_dollar", r"missing \$ inserted", _ErrBits.MISSING_DOLLAR),
+    ("missing_brace", r"missing [{}] inserted", _ErrBits.MISSING_BRACE),
+    ("runaway", r"runaway argument", _ErrBits.RUNAWAY),
+    ("file_not_found", r"file not found", _ErrBits.FILE_NOT_FOUND | _ErrBits.FILE | _ErrBits.NOT_FOUND),
+    ("emergency", r"emergency stop", _ErrBits.EMERGENCY),
+    ("fontspec_error", r"fontspec error", _ErrBits.FONTSPEC_ERROR | _ErrBits.FONTSPEC),
+    ("environment", r"environment", _ErrBits.ENVIRONMENT),
+    ("not_found", r"not found", _ErrBits.NOT_FOUND),
+    ("undefined", r"undefined", _ErrBits.UNDEFINED),
+    ("luatexja", r"luatexja", _ErrBits.LUATEXJA),
+    ("fontspec", r"fontspec", _ErrBits.FONTSPEC),
+    ("image", r"image", _ErrBits.IMAGE),
+    ("file", r"file", _ErrBits.FILE),
+)
+_ERR_GROUP_BITS: dict[str, _ErrBits] = {name: bits for name, _, bits in _ERR_GROUPS}
+# IGNORECASE で照合するのでログ全体を lower() した複製は作らない
+_ERR_RE = re.compile(
+    "|".join(f"(?=(?P<{name}>{pattern}))" for name, pattern, _ in _ERR_GROUPS),
+    re.IGNORECASE,
+)
+
+# 行番号ヒントだけを差し込む単純なエラー分類 (判定順に並べる)
+_SIMPLE_ERROR_MESSAGES: tuple[tuple[_ErrBits, str], ...] = (
+    (_ErrBits.MISSING_DOLLAR,
+     "数式記号の処理でエラーが発生しました{suffix}。$や%などの記号が入力に含まれていないか確認してください。"),
+    (_ErrBits.ALIGN,
+     "表の列数が一致していない可能性があります{suffix}。表の内容を確認してください。"),
+    (_ErrBits.MISSING_BRACE,
+     "波括弧 {{ }} の対応が取れていません{suffix}。"),
+    (_ErrBits.RUNAWAY,
+     "閉じられていない引数 (Runaway argument) があります{suffix}。{{ }} の対応を確認してください。"),
+    (_ErrBits.PAR_ENDED,
+     "段落が想定外の位置で終わりました{suffix}。引数の途中で空行が入っていないか確認してください。"),
+)
+
+
+# 行頭 (空白は許す) が `!` の行。str.strip() と同じく改行以外の空白を読み飛ばす
+_BANG_LINE_RE = re.compile(r"^[^\S\n]*(!.*)", re.MULTILINE)
+
+
+def _scan_error_keywords(log: str) -> _ErrBits:
+    """ログを 1 パスだけ走査し、出現したエラー分類のビットを返す"""
+    bits = _ErrBits(0)
+    for m in _ERR_RE.finditer(log):
+        bits |= _ERR_GROUP_BITS[m.lastgroup]
+    return bits
+
+
 def _parse_latex_error(log: str) -> str:
     """LaTeXログからユーザー向けエラーメッセージを推定。
 
@@ -499,18 +849,17 @@ def _parse_latex_error(log: str) -> str:
         return "PDFの作成中にエラーが発生しました。サーバーログを確認してください。"
 
     # 行折り返しを再結合してからキーワード判定する
-    from .latex_autofix import _unwrap_tex_log
     log = _unwrap_tex_log(log)
-    log_lower = log.lower()
 
-    # 1) `! ...` で始まる本物のエラー行を集める。
+    # 1) `! ...` で始まる最初の本物のエラー行を拾う。
     #    ただし「==> Fatal error occurred」だけは中身が無いので除外する。
-    error_lines = [
-        l.strip()
-        for l in log.split("\n")
-        if l.strip().startswith("!") and "fatal error occurred" not in l.lower()
-    ]
-    error_detail = error_lines[0] if error_lines else ""
+    #    ログ全体を行リストに split せず、`!` 行だけを先頭から順に走査する。
+    error_detail = ""
+    for m in _BANG_LINE_RE.finditer(log):
+        line_s = m.group(1).strip()
+        if "fatal error occurred" not in line_s.lower():
+            error_detail = line_s
+            break
 
     # 2) `-file-line-error` 形式 (`/path/document.tex:42: foo`) も拾う。
     #    こちらも Fatal フッタは除外する。
@@ -542,7 +891,9 @@ def _parse_latex_error(log: str) -> str:
     line_no = _extract_error_line_number(log)
     line_hint = f"行 {line_no}" if line_no else ""
 
-    if "undefined control sequence" in log_lower:
+    bits = _scan_error_keywords(log)
+
+    if bits & _ErrBits.UNDEF_CS:
         cmd = _extract_undefined_command_name(log)
         if cmd:
             base = f"未定義のコマンド {cmd} があります"
@@ -553,40 +904,29 @@ def _parse_latex_error(log: str) -> str:
         base += "。コマンド名のスペルを確認してください。"
         return base
 
-    if "environment" in log_lower and "undefined" in log_lower:
+    if bits & _ErrBits.ENVIRONMENT and bits & _ErrBits.UNDEFINED:
         env = _extract_undefined_environment_name(log)
         target = f"環境 {env} " if env else "環境"
         if line_hint:
             return f"未定義の{target}があります ({line_hint})。環境名と \\begin / \\end の対応を確認してください。"
         return f"未定義の{target}があります。環境名と \\begin / \\end の対応を確認してください。"
 
-    if "missing $ inserted" in log_lower:
-        suffix = f" ({line_hint})" if line_hint else ""
-        return f"数式記号の処理でエラーが発生しました{suffix}。$や%などの記号が入力に含まれていないか確認してください。"
-    if "extra alignment tab" in log_lower or "misplaced alignment" in log_lower:
-        suffix = f" ({line_hint})" if line_hint else ""
-        return f"表の列数が一致していない可能性があります{suffix}。表の内容を確認してください。"
-    if "missing } inserted" in log_lower or "missing { inserted" in log_lower:
-        suffix = f" ({line_hint})" if line_hint else ""
-        return f"波括弧 {{ }} の対応が取れていません{suffix}。"
-    if "runaway argument" in log_lower:
-        suffix = f" ({line_hint})" if line_hint else ""
-        return f"閉じられていない引数 (Runaway argument) があります{suffix}。{{ }} の対応を確認してください。"
-    if "paragraph ended before" in log_lower:
-        suffix = f" ({line_hint})" if line_hint else ""
-        return f"段落が想定外の位置で終わりました{suffix}。引数の途中で空行が入っていないか確認してください。"
-    if "file not found" in log_lower and "image" in log_lower:
+    for bit, template in _SIMPLE_ERROR_MESSAGES:
+        if bits & bit:
+            return template.format(suffix=f" ({line_hint})" if line_hint else "")
+
+    if bits & _ErrBits.FILE_NOT_FOUND and bits & _ErrBits.IMAGE:
         return "画像の読み込みに失敗しました。画像URLが正しいか確認してください。"
-    if "luatexja" in log_lower and "not found" in log_lower:
+    if bits & _ErrBits.LUATEXJA and bits & _ErrBits.NOT_FOUND:
         return "luatexjaパッケージが見つかりません。TeX Live が正しくインストールされているか確認してください。"
-    if "fontspec error" in log_lower or ("fontspec" in log_lower and "not found" in log_lower):
+    if bits & _ErrBits.FONTSPEC_ERROR or (bits & _ErrBits.FONTSPEC and bits & _ErrBits.NOT_FOUND):
         return f"フォントの読み込みに問題があります。({error_detail})"
-    if "emergency stop" in log_lower:
+    if bits & _ErrBits.EMERGENCY:
         # Emergency stop は副次エラー — 直前の本物のエラーがあればそちらを優先
         if error_detail and "emergency stop" not in error_detail.lower():
             return f"PDF生成エラー: {error_detail}"
         return f"文書の処理中に重大なエラーが発生しました。({error_detail or 'emergency stop'})"
-    if "file" in log_lower and "not found" in log_lower:
+    if bits & _ErrBits.FILE and bits & _ErrBits.NOT_FOUND:
         return f"必要なファイルが見つかりません。({error_detail})"
 
     if error_detail:
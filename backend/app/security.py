@@ -511,10 +511,12 @@ def get_compile_args(base_cmd: str, output_dir: str, tex_path: str) -> list[str]
     安全なコンパイル引数を生成。
     shell-escape は絶対に含めない。
     --no-shell-escape を明示的に指定。
+    --nosocket で LuaTeX の luasocket ライブラリも読み込ませない (起動時の初期化を省く)。
     """
     return [
         base_cmd,
         "--no-shell-escape",          # 明示的に禁止
+        "--nosocket",                 # ネットワークアクセス不要
         "-interaction=nonstopmode",
         "-halt-on-error",
         "-file-line-error",
@@ -532,6 +534,7 @@ def get_preview_compile_args(base_cmd: str, output_dir: str, tex_path: str) -> l
     return [
         base_cmd,
         "--no-shell-escape",
+        "--nosocket",
         "-interaction=nonstopmode",
         "-halt-on-error",
         "-output-directory", output_dir,
@@ -7,9 +7,12 @@
   - ウォームアップはコマンド存在確認のみ (コンパイルしない — メモリ節約)
   - Koyeb Free (512MB) での動作を保証
 """
+import functools
+import json
 import os
 import shutil
 import subprocess
+import sys
 import logging
 import threading
 from pathlib import Path
@@ -31,6 +34,27 @@ _TEXLIVE_PATHS = [
     "/usr/local/texlive/2024/bin/aarch64-linux",
     "/usr/bin",
 ]
+# 実在するものだけを 1 回の stat で絞り込んでおき、以降のループはこれだけを見る
+_EXISTING_TEXLIVE_DIRS = tuple(p for p in _TEXLIVE_PATHS if os.path.isdir(p))
+
+
+# TeX の子プロセスに引き継ぐ環境変数。API キーや DB URL を含むアプリの環境を
+# 丸ごと渡さず、spawn ごとに組み立てる environ 配列も小さく保つ。
+# TEXMF* (TEXMFVAR / TEXMFCONFIG / TEXMFCACHE など) は接頭辞で通す。
+_TEX_ENV_KEYS = (
+    "PATH", "HOME", "USER", "LOGNAME", "TMPDIR", "TZ",
+    "LANG", "LC_ALL", "LC_CTYPE",
+    "TEXINPUTS", "BIBINPUTS", "BSTINPUTS", "LUAINPUTS", "OSFONTDIR",
+    "FONTCONFIG_FILE", "FONTCONFIG_PATH",
+    "LD_LIBRARY_PATH",  # 独自ビルドの TeX Live / HarfBuzz が共有ライブラリを探す
+    "PERL5LIB",  # pdfcrop など Perl 製ツール
+    "XDG_CACHE_HOME",  # fontconfig のキャッシュ置き場
+    "SYSTEMROOT", "COMSPEC", "PATHEXT", "TEMP", "TMP",  # Windows の子プロセス起動・一時ファイル
+)
+# 上記以外に通したい変数 (例: SOURCE_DATE_EPOCH) はカンマ区切りで明示する
+_TEX_ENV_PASSTHROUGH = tuple(
+    k.strip() for k in os.environ.get("TEX_ENV_PASSTHROUGH", "").split(",") if k.strip()
+)
 
 
 def _build_texlive_env() -> dict[str, str]:
@@ -40,11 +64,22 @@ def _build_texlive_env() -> dict[str, str]:
     (デフォルト 79 字) を抑止する。これにより autofix のログ解析が
     `Un\\ndefined control sequence` のような分断を心配せずに済む。
     """
-    env = os.environ.copy()
+    env = {
+        k: v for k, v in os.environ.items()
+        if k in _TEX_ENV_KEYS or k in _TEX_ENV_PASSTHROUGH or k.startswith("TEXMF")
+    }
+    # 落とした変数名だけ残しておく (値は秘密を含みうるので出さない)。
+    # TeX が必要な変数を失って失敗したときに TEX_ENV_PASSTHROUGH で足す手がかりにする。
+    dropped = sorted(k for k in os.environ if k not in env)
+    if dropped:
+        logger.info("TeX subprocess env drops %d variables: %s", len(dropped), ", ".join(dropped))
     current_path = env.get("PATH", "")
-    extra = [p for p in _TEXLIVE_PATHS if Path(p).is_dir() and p not in current_path]
+    # 部分文字列一致だと "/usr/bin" が "/usr/bin/local" に誤一致するので要素単位で比較する
+    path_set = set(current_path.split(os.pathsep))
+    extra = [p for p in _EXISTING_TEXLIVE_DIRS if p not in path_set]
     if extra:
-        env["PATH"] = ":".join(extra) + ":" + current_path
+        # PATH が空のときに末尾の区切り文字 (= カレントディレクトリ) を作らない
+        env["PATH"] = os.pathsep.join([*extra, current_path] if current_path else extra)
         logger.info(f"Added TeX Live paths: {extra}")
     # ログ行を折り返さないようにする (autofix のエラー解析向け)
     # ※ error_line / half_error_line は TeX の内部定数バウンドが厳しく
@@ -54,16 +89,29 @@ def _build_texlive_env() -> dict[str, str]:
     return env
 
 
+@functools.cache
+def _bin_index() -> dict[str, str]:
+    """TeX Live の bin ディレクトリを 1 回ずつ scandir した「コマンド名 → パス」表。
+
+    shutil.which で見つからなかったときだけ必要になるので初回参照時に作る。
+    先に並んでいるディレクトリを優先する (従来の候補ループと同じ順序)。
+    """
+    index: dict[str, str] = {}
+    for base in _EXISTING_TEXLIVE_DIRS:
+        try:
+            with os.scandir(base) as it:
+                for entry in it:
+                    if entry.name not in index and entry.is_file():
+                        index[entry.name] = entry.path
+        except OSError:
+            continue
+    return index
+
+
+@functools.lru_cache(maxsize=None)
 def find_command(name: str) -> str:
-    """TeX Live コマンドのフルパスを返す"""
-    found = shutil.which(name)
-    if found:
-        return found
-    for base in _TEXLIVE_PATHS:
-        candidate = Path(base) / name
-        if candidate.is_file():
-            return str(candidate)
-    return name
+    """TeX Live コマンドのフルパスを返す (PATH 走査はプロセス内で 1 回だけ)"""
+    return shutil.which(name) or _bin_index().get(name, name)
 
 
 # ── 環境とコマンドのキャッシュ ──
@@ -71,6 +119,7 @@ TEX_ENV = _build_texlive_env()
 LUALATEX_CMD = find_command("lualatex")
 PDFTOCAIRO_CMD = find_command("pdftocairo")
 DVISVGM_CMD = find_command("dvisvgm")
+KPSEWHICH_CMD = find_command("kpsewhich")
 
 # 後方互換のため残す (preview_service 等が参照する可能性)
 PDFLATEX_CMD = LUALATEX_CMD
@@ -79,16 +128,24 @@ XELATEX_CMD = LUALATEX_CMD
 # 固定エンジン
 DEFAULT_ENGINE = "lualatex"
 FALLBACK_ENGINES: list[str] = []  # フォールバックなし
+ENGINE_CMD: dict[str, str] = {"lualatex": LUALATEX_CMD}
 
 # ══════════════════════════════════════════════════════════════════
 # 2. パッケージ検出 (luatexja のみ確認すれば十分)
 # ══════════════════════════════════════════════════════════════════
 
-def _check_sty_kpsewhich(name: str, env: dict) -> str | None:
+@functools.lru_cache(maxsize=None)
+def _check_sty_kpsewhich(name: str) -> str | None:
+    """kpsewhich で .sty を探す。見つからなかった結果 (None) も含めてプロセス内で覚える。
+
+    結果はプロセスの寿命の間だけ有効で、実行中に無効化する経路は無い。texhash 等で
+    TeX のファイルデータベースを更新したら、LATEX_GUI_REPROBE=1 を付けてプロセスを
+    再起動する (ディスク上の判定キャッシュ TEX_PROBE_CACHE も同時に作り直される)。
+    """
     try:
         r = subprocess.run(
-            [find_command("kpsewhich"), name],
-            capture_output=True, text=True, timeout=10, env=env,
+            [KPSEWHICH_CMD, name],
+            capture_output=True, text=True, timeout=10, env=TEX_ENV,
         )
         path = r.stdout.strip()
         if r.returncode == 0 and path:
@@ -98,13 +155,156 @@ def _check_sty_kpsewhich(name: str, env: dict) -> str | None:
     return None
 
 
+def _check_sty_batch(names: tuple[str, ...]) -> dict[str, str | None]:
+    """複数の .sty を kpsewhich 1 回で探す (起動 + ls-R 読み込みを 1 回で済ませる)。
+
+    kpsewhich は見つかったファイルのパスだけを出力し、見つからない名前には何も
+    出さないので、出力行はベース名で引き当てる。起動自体に失敗したら 1 件ずつ調べ直す。
+    """
+    try:
+        r = subprocess.run(
+            [KPSEWHICH_CMD, *names],
+            capture_output=True, text=True, timeout=10, env=TEX_ENV,
+        )
+    except Exception:
+        return {name: _check_sty_kpsewhich(name) for name in names}
+
+    found: dict[str, str] = {}
+    for line in r.stdout.splitlines():
+        path = line.strip()
+        if path:
+            found.setdefault(os.path.basename(path), path)
+    return {name: found.get(name) for name in names}
+
+
 def _cmd_exists(cmd: str) -> bool:
-    return bool(shutil.which(cmd) or Path(cmd).is_file())
+    # cmd は find_command 済み (見つかっていれば絶対パス) なので PATH を歩き直さない
+    return os.path.isfile(cmd) and os.access(cmd, os.X_OK)
+
+
+# エンジン実行ファイルの有無は起動時に 1 回だけ判定する (リクエストごとに PATH を stat しない)
+ENGINE_AVAILABLE: dict[str, bool] = {name: _cmd_exists(cmd) for name, cmd in ENGINE_CMD.items()}
+
+
+def _resolve_tool(name: str) -> str | None:
+    cmd = find_command(name)
+    return cmd if _cmd_exists(cmd) else None
+
+
+# 図プレビューの後処理ツール。無ければ None (こちらも起動時に 1 回だけ解決する)
+PDFCROP_CMD = _resolve_tool("pdfcrop")
+PDFTOPPM_CMD = _resolve_tool("pdftoppm")
+
+
+# ── 判定結果のディスクキャッシュ ──
+# kpsewhich はプロセス起動 + ls-R 読み込みで 1 回数十 ms かかり、ワーカー起動の
+# たびに繰り返される。lualatex バイナリの stat を指紋にして結果を JSON に残し、
+# 指紋が一致して記録したパスが実在する間は kpsewhich を起動しない。
+_PROBE_CACHE_PATH = Path(
+    os.environ.get("TEX_PROBE_CACHE", "").strip()
+    or Path.home() / ".cache" / "latex_gui" / "engine_probe.json"
+)
+_PROBE_CACHE_VERSION = 1
+# LATEX_GUI_REPROBE=1 でディスクキャッシュを無視して kpsewhich で判定し直す (結果は書き戻す)
+_FORCE_REPROBE = os.environ.get("LATEX_GUI_REPROBE", "").strip() == "1"
+_PROBED_STY = ("luatexja.sty", "luatexja-preset.sty")
+
+
+def _engine_fingerprint() -> str | None:
+    try:
+        st = os.stat(LUALATEX_CMD)
+    except OSError:
+        return None
+    return f"{LUALATEX_CMD}:{st.st_mtime_ns}:{st.st_size}:{sys.platform}"
+
+
+def _load_probe_cache(fingerprint: str) -> dict[str, str] | None:
+    try:
+        data = json.loads(_PROBE_CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != _PROBE_CACHE_VERSION or data.get("fingerprint") != fingerprint:
+        return None
+    results = data.get("results")
+    if not isinstance(results, dict):
+        return None
+    # パッケージの削除・移動でパスが消えていたら信用しない
+    for path in results.values():
+        if not (isinstance(path, str) and os.path.isfile(path)):
+            return None
+    return results
+
+
+def _save_probe_cache(fingerprint: str, results: dict[str, str]) -> None:
+    try:
+        _PROBE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = _PROBE_CACHE_PATH.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "version": _PROBE_CACHE_VERSION,
+            "fingerprint": fingerprint,
+            "results": results,
+        }), encoding="utf-8")
+        os.replace(tmp, _PROBE_CACHE_PATH)
+    except OSError as e:
+        logger.debug(f"[init] Could not write probe cache {_PROBE_CACHE_PATH}: {e}")
+
+
+@functools.cache
+def get_engine_probe() -> dict[str, str | None]:
+    """luatexja 系 .sty の検出結果 (ファイル名 → パス or None) を返す。
+
+    初回呼び出し時にだけ判定する。ディスクキャッシュが有効ならそれを使い、
+    無ければ kpsewhich で調べる。陰性結果は後からインストールされうるので
+    保存しない (次回起動時に再判定する)。
+    """
+    fingerprint = _engine_fingerprint()
+    if fingerprint and not _FORCE_REPROBE:
+        cached = _load_probe_cache(fingerprint)
+        if cached is not None and all(name in cached for name in _PROBED_STY):
+            return dict(cached)
+
+    results = _check_sty_batch(_PROBED_STY)
+    if fingerprint and all(results.values()):
+        _save_probe_cache(fingerprint, results)
+    return results
 
 
-LUATEXJA_STY_AVAILABLE = bool(_check_sty_kpsewhich("luatexja.sty", TEX_ENV))
-LUATEXJA_PRESET_AVAILABLE = bool(_check_sty_kpsewhich("luatexja-preset.sty", TEX_ENV))
-LUALATEX_AVAILABLE = _cmd_exists(LUALATEX_CMD) and LUATEXJA_STY_AVAILABLE
+@functools.cache
+def _probe_flags() -> dict[str, bool]:
+    """kpsewhich 判定に依存するフラグ。import 時ではなく初回参照時に 1 回だけ計算する。
+
+    TEX_ENV や *_CMD だけが欲しいモジュール (図プレビュー等) の import で
+    kpsewhich を起動しないよう、下の __getattr__ 経由で遅延評価する。
+    """
+    probe = get_engine_probe()
+    sty_ok = bool(probe["luatexja.sty"])
+    flags = {
+        "LUATEXJA_STY_AVAILABLE": sty_ok,
+        "LUATEXJA_PRESET_AVAILABLE": bool(probe["luatexja-preset.sty"]),
+        "LUALATEX_AVAILABLE": ENGINE_AVAILABLE["lualatex"] and sty_ok,
+    }
+    logger.info(
+        f"[init] LuaLaTeX-only mode: "
+        f"lualatex={'avail' if flags['LUALATEX_AVAILABLE'] else 'N/A'}, "
+        f"luatexja.sty={'OK' if flags['LUATEXJA_STY_AVAILABLE'] else 'NG'}, "
+        f"luatexja-preset.sty={'OK' if flags['LUATEXJA_PRESET_AVAILABLE'] else 'NG'}"
+    )
+    return flags
+
+
+_LAZY_PROBE_FLAGS = frozenset({
+    "LUATEXJA_STY_AVAILABLE", "LUATEXJA_PRESET_AVAILABLE", "LUALATEX_AVAILABLE",
+})
+
+
+def __getattr__(name: str):
+    # PEP 562: LUALATEX_AVAILABLE 等は初回アクセス時に判定し、以後はモジュール属性として引ける
+    if name in _LAZY_PROBE_FLAGS:
+        value = _probe_flags()[name]
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # 後方互換エイリアス
 CJK_STY_AVAILABLE = False
@@ -145,7 +345,8 @@ def _run_warmup():
 
     logger.info("[warmup] Checking lualatex availability (no compile test — saving memory)...")
 
-    if LUALATEX_AVAILABLE:
+    lualatex_available = _probe_flags()["LUALATEX_AVAILABLE"]
+    if lualatex_available:
         LUALATEX_JA_OK = True
         _lualatex_cache_warm = True
         logger.info("[warmup] lualatex + luatexja available (build-verified). Cache assumed warm.")
@@ -154,6 +355,12 @@ def _run_warmup():
 
     _warmup_event.set()
 
+    # 待ち合わせ解除後に、初回コンパイルで読むファイルをページキャッシュへ先読みさせる
+    if lualatex_available:
+        n = _prefetch_tex_files()
+        if n:
+            logger.info(f"[warmup] Prefetched {n} TeX files into page cache")
+
 
 def start_background_warmup():
     """バックグラウンドでウォームアップスレッドを開始"""
@@ -185,12 +392,6 @@ def is_lualatex_cache_warm() -> bool:
 
 
 # ── ログ出力 ──
-logger.info(
-    f"[init] LuaLaTeX-only mode: "
-    f"lualatex={'avail' if LUALATEX_AVAILABLE else 'N/A'}, "
-    f"luatexja.sty={'OK' if LUATEXJA_STY_AVAILABLE else 'NG'}, "
-    f"luatexja-preset.sty={'OK' if LUATEXJA_PRESET_AVAILABLE else 'NG'}"
-)
 logger.info(f"[init] Commands: lualatex={LUALATEX_CMD}, pdftocairo={PDFTOCAIRO_CMD}")
 
 
@@ -206,8 +407,56 @@ _LIBGS_CANDIDATES = [
     "/usr/lib64/libgs.so",
     "/usr/lib/libgs.so",
 ]
-for _p in _LIBGS_CANDIDATES:
-    if Path(_p).is_file():
-        TEX_ENV["LIBGS"] = _p
-        logger.info(f"LIBGS set to {_p}")
-        break
+_EXISTING_LIBGS = next((p for p in _LIBGS_CANDIDATES if os.path.isfile(p)), None)
+if _EXISTING_LIBGS:
+    TEX_ENV["LIBGS"] = _EXISTING_LIBGS
+    logger.info(f"LIBGS set to {_EXISTING_LIBGS}")
+
+
+# ══════════════════════════════════════════════════════════════════
+# 5. ページキャッシュ先読み
+#
+# アイドル明けの初回コンパイルは lualatex.fmt と HaranoAji フォント
+# (計 数十 MB) を同期的にディスクから page-in する待ちが大きい。
+# 起動時に posix_fadvise(WILLNEED) でカーネルに先読みさせておく。
+# ファイルを mmap して保持するわけではないので RSS は増えない
+# (ページキャッシュは回収可能)。TEX_PREFETCH=0 で無効化できる。
+# ══════════════════════════════════════════════════════════════════
+
+TEX_PREFETCH_ENABLED = os.environ.get("TEX_PREFETCH", "1") != "0"
+
+_PREFETCH_FILES = (
+    "lualatex.fmt",
+    "HaranoAjiMincho-Regular.otf",
+    "HaranoAjiGothic-Medium.otf",
+)
+
+
+def _prefetch_tex_files() -> int:
+    """format / 和文フォントをページキャッシュへ先読みさせ、対象ファイル数を返す"""
+    if not TEX_PREFETCH_ENABLED or not hasattr(os, "posix_fadvise"):
+        return 0
+    try:
+        # kpsewhich は見つかったファイルのパスだけを 1 行ずつ出力する
+        r = subprocess.run(
+            [KPSEWHICH_CMD, "-engine=luahbtex", *_PREFETCH_FILES],
+            capture_output=True, text=True, timeout=10, env=TEX_ENV,
+        )
+    except Exception:
+        return 0
+
+    count = 0
+    for path in r.stdout.splitlines():
+        path = path.strip()
+        if not path:
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+            count += 1
+        except OSError:
+            continue
+    return count
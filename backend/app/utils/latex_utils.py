@@ -1,6 +1,8 @@
 """
 LaTeX特殊文字エスケープ、共通変換ユーティリティ
 """
+import functools
+import re
 
 # LaTeX特殊文字のエスケープマップ
 _LATEX_SPECIAL_CHARS = {
@@ -17,51 +19,93 @@ _LATEX_SPECIAL_CHARS = {
 }
 
 
+# str.translate 用の変換表 (1 文字 → 置換文字列を C ループ 1 パスで処理する)
+_LATEX_ESCAPE_TABLE = str.maketrans(_LATEX_SPECIAL_CHARS)
+# 特殊文字を 1 つも含まない入力 (大半の日本語の文章) はこれで判定して素通しする。
+# 非 ASCII 文字列では translate が遅い汎用ループに落ちるため、先に検索した方が速い。
+_LATEX_SPECIAL_RE = re.compile("[" + re.escape("".join(_LATEX_SPECIAL_CHARS)) + "]")
+
+
+# 表の見出しやリスト項目のように短い文字列は同じものが繰り返し来るので結果を覚える。
+# 長い段落はキャッシュに載せない (メモリを食うだけで当たらない)。
+_ESCAPE_CACHE_MAX_LEN = 64
+
+
+@functools.lru_cache(maxsize=4096)
+def _escape_short(text: str) -> str:
+    return text.translate(_LATEX_ESCAPE_TABLE)
+
+
 def escape_latex(text: str) -> str:
     """ユーザー入力をLaTeX安全な文字列に変換する"""
     if not text:
         return ""
-    result = []
-    for char in text:
-        if char in _LATEX_SPECIAL_CHARS:
-            result.append(_LATEX_SPECIAL_CHARS[char])
-        else:
-            result.append(char)
-    return "".join(result)
+    if len(text) <= _ESCAPE_CACHE_MAX_LEN:
+        if _LATEX_SPECIAL_RE.search(text) is None:
+            return text
+        return _escape_short(text)
+    # 長い文字列は 1 文字ずつの `in` (memchr ベースの高速検索) の方が正規表現より速い
+    if not any(ch in text for ch in _LATEX_SPECIAL_CHARS):
+        return text
+    return text.translate(_LATEX_ESCAPE_TABLE)
 
 
 def text_to_latex_paragraphs(text: str) -> str:
     """複数行テキストをLaTeXの段落に変換"""
     if not text:
         return ""
-    paragraphs = text.strip().split("\n\n")
-    escaped = [escape_latex(p.replace("\n", " ")) for p in paragraphs]
-    return "\n\n".join(escaped)
+    # エスケープは 1 文字単位で改行に触れないので、先に全体を 1 回だけ処理してから段落に分ける
+    paragraphs = escape_latex(text.strip()).split("\n\n")
+    return "\n\n".join(p.replace("\n", " ") for p in paragraphs)
+
+
+def _build_list(env: str, items: list[str]) -> str:
+    return "\n".join((
+        f"\\begin{{{env}}}",
+        *[f"  \\item {escape_latex(item)}" for item in items],
+        f"\\end{{{env}}}",
+    ))
 
 
 def build_itemize(items: list[str]) -> str:
     """箇条書き（bullet）を生成"""
-    lines = ["\\begin{itemize}"]
-    for item in items:
-        lines.append(f"  \\item {escape_latex(item)}")
-    lines.append("\\end{itemize}")
-    return "\n".join(lines)
+    return _build_list("itemize", items)
 
 
 def build_enumerate(items: list[str]) -> str:
     """番号付きリストを生成"""
-    lines = ["\\begin{enumerate}"]
-    for item in items:
-        lines.append(f"  \\item {escape_latex(item)}")
-    lines.append("\\end{enumerate}")
-    return "\n".join(lines)
+    return _build_list("enumerate", items)
+
+
+# build_table で 1 行分のセルをつなぐ番兵。_LATEX_SPECIAL_CHARS に無い制御文字なので
+# escape_latex (translate) をそのまま素通りし、後で split すれば元のセル境界に戻る。
+_CELL_SEP = "\x1f"
+
+
+def _escape_cells(cells: list[str]) -> list[str]:
+    """1 行分のセルを escape_latex 1 回でまとめてエスケープする"""
+    joined = _CELL_SEP.join(cells)
+    if joined.count(_CELL_SEP) != len(cells) - 1:
+        # セル自体に番兵が含まれている (または空行) ときは 1 セルずつ処理する
+        return [escape_latex(c) for c in cells]
+    return escape_latex(joined).split(_CELL_SEP)
+
+
+# 各行末の「\\ + 罫線」と表の閉じ。行ごとの append を 1 回にまとめるため改行込みの定数にする
+_TABLE_ROW_END = " \\\\\n\\hline"
+_TABLE_END = "\\end{tabular}\n\\end{table}"
+
+
+@functools.lru_cache(maxsize=32)
+def _col_spec(col_count: int) -> str:
+    """tabular の列指定 (全列 l、縦罫線あり)。表の列数は数種類しかないので使い回す"""
+    return f"|{'|'.join('l' * col_count)}|"
 
 
 def build_table(headers: list[str], rows: list[list[str]]) -> str:
     """表を生成"""
     col_count = len(headers)
-    col_spec = "|".join(["l"] * col_count)
-    col_spec = f"|{col_spec}|"
+    col_spec = _col_spec(col_count)
 
     lines = [
         "\\begin{table}[h]",
@@ -69,32 +113,21 @@ def build_table(headers: list[str], rows: list[list[str]]) -> str:
         f"\\begin{{tabular}}{{{col_spec}}}",
         "\\hline",
     ]
-    header_cells = " & ".join(f"\\textbf{{{escape_latex(h)}}}" for h in headers)
-    lines.append(f"{header_cells} \\\\")
-    lines.append("\\hline")
+    header_cells = " & ".join(f"\\textbf{{{h}}}" for h in _escape_cells(headers))
+    lines.append(header_cells + _TABLE_ROW_END)
 
     for row in rows:
-        # 列数が足りない場合は空文字で補完、多い場合は切り捨て
-        padded = row[:col_count]
-        while len(padded) < col_count:
-            padded.append("")
-        cells = " & ".join(escape_latex(c) for c in padded)
-        lines.append(f"{cells} \\\\")
-        lines.append("\\hline")
-
-    lines.append("\\end{tabular}")
-    lines.append("\\end{table}")
+        # 列数が足りない場合は空文字で補完、多い場合は切り捨て (負の乗数は空リスト)
+        padded = row[:col_count] + [""] * (col_count - len(row))
+        lines.append(" & ".join(_escape_cells(padded)) + _TABLE_ROW_END)
+
+    lines.append(_TABLE_END)
     return "\n".join(lines)
 
 
 def build_image(url: str, caption: str = "", width: float = 0.8) -> str:
     """画像ブロックを生成（URL参照）"""
-    lines = [
-        "\\begin{figure}[h]",
-        "\\centering",
-        f"\\includegraphics[width={width}\\textwidth]{{{url}}}",
-    ]
+    head = f"\\begin{{figure}}[h]\n\\centering\n\\includegraphics[width={width}\\textwidth]{{{url}}}\n"
     if caption:
-        lines.append(f"\\caption{{{escape_latex(caption)}}}")
-    lines.append("\\end{figure}")
-    return "\n".join(lines)
+        return f"{head}\\caption{{{escape_latex(caption)}}}\n\\end{{figure}}"
+    return f"{head}\\end{{figure}}"
@@ -0,0 +1,43 @@
+"""Unit tests for the in-process preview rasterizer in app.figures.raster.
+
+Run from backend/:  python -m pytest tests/test_figure_raster.py -v
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+fitz = pytest.importorskip("fitz")
+
+from app.figures import raster  # noqa: E402
+
+
+def _line_pdf(path: Path, segments: int) -> Path:
+    doc = fitz.open()
+    page = doc.new_page(width=200, height=200)
+    shape = page.new_shape()
+    for i in range(segments):
+        shape.draw_line((i % 200, (i * 7) % 200), ((i * 13) % 200, (i * 3) % 200))
+        shape.finish(width=1)
+    shape.commit()
+    doc.save(str(path), deflate=True)
+    return path
+
+
+def test_small_page_renders_in_process(tmp_path):
+    pdf = _line_pdf(tmp_path / "small.pdf", 10)
+    out = tmp_path / "small.png"
+    assert raster.render_first_page_png(pdf, out)
+    assert out.stat().st_size > 0
+
+
+def test_dense_page_is_left_to_pdftoppm(tmp_path, monkeypatch):
+    monkeypatch.setattr(raster, "PREVIEW_INPROCESS_MAX_BYTES", 1024)
+    pdf = _line_pdf(tmp_path / "dense.pdf", 2000)
+    out = tmp_path / "dense.png"
+    assert not raster.render_first_page_png(pdf, out)
+    assert not out.exists()
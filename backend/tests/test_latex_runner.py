@@ -0,0 +1,57 @@
+"""Unit tests for the shared LaTeX subprocess runner.
+
+Run from backend/:  python -m pytest tests/test_latex_runner.py -v
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+from app.latex_runner import run_latex  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "killpg"), reason="POSIX process groups only")
+
+
+def test_run_latex_captures_output(tmp_path):
+    run = asyncio.run(run_latex(
+        ["sh", "-c", "echo out; echo err >&2; exit 3"],
+        cwd=str(tmp_path), timeout=5, capture_limit=1024,
+    ))
+    assert (run.returncode, run.stdout, run.stderr) == (3, b"out\n", b"err\n")
+
+
+def test_run_latex_timeout_not_held_by_grandchild_pipes(tmp_path):
+    # 孫プロセスが stdout を握ったまま残っても timeout で戻り、孫も kill される
+    marker = tmp_path / "grandchild.pid"
+    script = f"sleep 8 & echo $! > {marker}; echo started; sleep 30"
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run_latex(["sh", "-c", script], cwd=str(tmp_path), timeout=1, capture_limit=1024))
+    assert time.monotonic() - start < 4
+
+    pid = int(marker.read_text())
+    for _ in range(50):
+        if not _alive(pid):
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("grandchild survived the timeout")
+
+
+def _alive(pid: int) -> bool:
+    # 親を失った孫は init が回収するまでゾンビで残ることがあるので、それは死亡扱い
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        return Path(f"/proc/{pid}/stat").read_text().split(") ", 1)[1][0] != "Z"
+    except (OSError, IndexError):
+        return True
@@ -0,0 +1,94 @@
+"""Unit tests for the LaTeX string helpers in app.utils.latex_utils.
+
+Run from backend/:  python -m pytest tests/test_latex_utils.py -v
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+from app.utils.latex_utils import (  # noqa: E402
+    build_enumerate,
+    build_image,
+    build_itemize,
+    build_table,
+    escape_latex,
+    text_to_latex_paragraphs,
+)
+
+
+# ─── escape_latex ──────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("text", ["", None])
+def test_escape_empty(text):
+    assert escape_latex(text) == ""
+
+
+def test_escape_plain_text_unchanged():
+    assert escape_latex("abc 日本語 123") == "abc 日本語 123"
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("&", r"\&"),
+        ("%", r"\%"),
+        ("$", r"\$"),
+        ("#", r"\#"),
+        ("_", r"\_"),
+        ("{", r"\{"),
+        ("}", r"\}"),
+        ("~", r"\textasciitilde{}"),
+        ("^", r"\textasciicircum{}"),
+        ("\\", r"\textbackslash{}"),
+    ],
+)
+def test_escape_each_special_char(text, expected):
+    assert escape_latex(text) == expected
+
+
+def test_escape_backslash_braces_not_double_escaped():
+    # \ の置換結果に含まれる {} を再度エスケープしない
+    assert escape_latex("\\{x}") == r"\textbackslash{}\{x\}"
+
+
+# ─── text_to_latex_paragraphs ──────────────────────────────────────────
+
+def test_paragraphs_join_lines_and_escape():
+    assert text_to_latex_paragraphs("  a\nb_1\n\nc%  ") == "a b\\_1\n\nc\\%"
+
+
+# ─── build_itemize / build_enumerate ───────────────────────────────────
+
+def test_build_itemize_escapes_items():
+    assert build_itemize(["a&b", "c"]) == "\\begin{itemize}\n  \\item a\\&b\n  \\item c\n\\end{itemize}"
+
+
+def test_build_enumerate_empty():
+    assert build_enumerate([]) == "\\begin{enumerate}\n\\end{enumerate}"
+
+
+# ─── build_table ───────────────────────────────────────────────────────
+
+def test_build_table_escapes_and_pads_cells():
+    out = build_table(["a_b", "c"], [["1&2"], ["x", "y", "z"]])
+    assert r"\textbf{a\_b} & \textbf{c} \\" in out
+    assert r"1\&2 &  \\" in out
+    assert r"x & y \\" in out
+
+
+def test_build_table_cell_containing_separator_char_keeps_columns():
+    out = build_table(["h"], [["a\x1fb"]])
+    assert "a\x1fb \\\\" in out
+
+
+# ─── build_image ───────────────────────────────────────────────────────
+
+def test_build_image_with_and_without_caption():
+    base = "\\begin{figure}[h]\n\\centering\n\\includegraphics[width=0.5\\textwidth]{a.png}\n"
+    assert build_image("a.png", width=0.5) == base + "\\end{figure}"
+    assert build_image("a.png", "x_y", 0.5) == base + "\\caption{x\\_y}\n\\end{figure}"
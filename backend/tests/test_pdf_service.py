@@ -0,0 +1,188 @@
+"""Unit tests for the LaTeX error-log parsing in pdf_service.
+
+Run from backend/:  python -m pytest tests/test_pdf_service.py -v
+"""
+from __future__ import annotations
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest  # noqa: E402
+
+from app.pdf_service import (  # noqa: E402
+    _ErrBits,
+    _extract_error_line_number,
+    _parse_latex_error,
+    _scan_error_keywords,
+    _strip_temp_paths,
+)
+
+
+# ─── _parse_latex_error ────────────────────────────────────────────────
+
+def test_parse_empty_log():
+    assert "サーバーログ" in _parse_latex_error("")
+
+
+def test_parse_undefined_control_sequence_names_command_and_line():
+    log = "This is LuaHBTeX\n! Undefined control sequence.\nl.42 \\foo\n           {x}\n"
+    msg = _parse_latex_error(log)
+    assert "\\foo" in msg
+    assert "行 42" in msg
+
+
+def test_parse_file_line_error_format():
+    log = "/tmp/tmpabc/document.tex:7: Undefined control sequence.\nl.7 \\bar\n"
+    msg = _parse_latex_error(log)
+    assert "\\bar" in msg
+    assert "行 7" in msg
+
+
+def test_parse_undefined_environment():
+    log = "! LaTeX Error: Environment fooenv undefined.\nl.10 \\begin{fooenv}\n"
+    msg = _parse_latex_error(log)
+    assert "環境 fooenv" in msg
+    assert "行 10" in msg
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("! Missing $ inserted.", "数式記号"),
+        ("! Extra alignment tab has been changed to \\cr.", "表の列数"),
+        ("! Misplaced alignment tab character &.", "表の列数"),
+        ("! Missing } inserted.", "波括弧"),
+        ("Runaway argument?", "Runaway argument"),
+        ("! Paragraph ended before \\textbf was complete.", "段落"),
+        ("! LaTeX Error: file not found for image diagram.png.", "画像"),
+        ("! Package luatexja Error: luatexja.sty not found.", "luatexja"),
+        ("! fontspec error: \"font-not-found\"", "フォント"),
+        ("! Package fontspec Error: The font \"Foo\" cannot be not found.", "フォント"),
+        ("! LaTeX Error: File `missing.sty' not found.", "必要なファイル"),
+    ],
+)
+def test_parse_keyword_classes(line, expected):
+    assert expected in _parse_latex_error(f"This is LuaHBTeX\n{line}\nl.3 x\n")
+
+
+def test_parse_emergency_stop_prefers_real_error():
+    log = "! Something odd happened.\n! Emergency stop.\n"
+    assert _parse_latex_error(log) == "PDF生成エラー: ! Something odd happened."
+
+
+def test_parse_emergency_stop_alone():
+    assert "重大なエラー" in _parse_latex_error("! Emergency stop.\n")
+
+
+def test_parse_skips_fatal_footer():
+    log = "! Custom failure here.\n!  ==> Fatal error occurred, no output PDF file produced!\n"
+    assert _parse_latex_error(log) == "PDF生成エラー: ! Custom failure here."
+
+
+def test_parse_falls_back_to_log_tail():
+    msg = _parse_latex_error("(./document.tex\nsomething went wrong badly\n")
+    assert "something went wrong" in msg
+
+
+@pytest.mark.parametrize(
+    "log, bit",
+    [
+        # _unwrap_tex_log は折り返し行を区切りなしで連結するので、キーワード同士が重なりうる
+        ("filextra alignment tab", _ErrBits.ALIGN),
+        ("filemergency stop", _ErrBits.EMERGENCY),
+        ("undefined control sequencenvironment", _ErrBits.ENVIRONMENT),
+    ],
+)
+def test_scan_error_keywords_overlapping(log, bit):
+    assert bit in _scan_error_keywords(log)
+
+
+# ─── helpers ───────────────────────────────────────────────────────────
+
+def test_extract_error_line_number_prefers_file_line_error():
+    assert _extract_error_line_number("x/document.tex:12: boom\nl.99 \\x") == 12
+    assert _extract_error_line_number("l.99 \\x") == 99
+    assert _extract_error_line_number("no numbers") is None
+
+
+def test_strip_temp_paths():
+    assert _strip_temp_paths("/tmp/tmpevc2ejh1/document.tex:118: ==> Fatal") == "(line 118): ==> Fatal"
+
+
+# ─── admission control ────────────────────────────────────────────────
+
+def test_admission_survives_cancelled_waiter(monkeypatch):
+    import asyncio
+
+    from app import pdf_service
+
+    async def scenario():
+        # モジュール読み込み時とは別のループで動かすので Condition を作り直す
+        monkeypatch.setattr(pdf_service, "_admit_cv", asyncio.Condition())
+        monkeypatch.setattr(pdf_service, "_inflight", 0)
+        monkeypatch.setattr(pdf_service, "_max_inflight", 1)
+        release_a = asyncio.Event()
+
+        async def holder():
+            async with pdf_service._compile_admission():
+                await release_a.wait()
+
+        async def waiter():
+            async with pdf_service._compile_admission():
+                pass
+
+        a = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        b = asyncio.create_task(waiter())
+        c = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        # A が枠を返した直後、起こされた B がキャンセルされる
+        release_a.set()
+        await asyncio.sleep(0)
+        b.cancel()
+        await a
+        await asyncio.wait_for(c, timeout=1)
+        assert pdf_service.get_compile_concurrency()["inflight"] == 0
+
+    asyncio.run(scenario())
+
+
+# ─── compile_pdf_file の送出用パス ─────────────────────────────────────
+
+def test_served_pdf_survives_cache_eviction(tmp_path):
+    from app.cache_service import link_pdf_for_serving
+    from app.pdf_service import release_pdf_file
+
+    cached = tmp_path / "key.pdf"
+    cached.write_bytes(b"%PDF-1.7 test")
+    served = link_pdf_for_serving(cached)
+    assert served is not None and served != cached
+
+    cached.unlink()  # TTL 失効 / LRU 追い出し相当
+    assert served.read_bytes() == b"%PDF-1.7 test"
+
+    release_pdf_file(served)
+    assert not served.exists()
+    assert link_pdf_for_serving(cached) is None
+
+
+def test_stale_serving_file_swept_by_name_time(tmp_path, monkeypatch):
+    from app import cache_service
+
+    monkeypatch.setattr(cache_service, "PDF_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(cache_service, "_last_serving_sweep", 0.0)
+    cached = tmp_path / "key.pdf"
+    cached.write_bytes(b"%PDF-1.7 test")
+    fresh = cache_service.link_pdf_for_serving(cached)
+    # ハードリンクは mtime を共有するので、放置判定は名前に埋めた作成時刻で行う
+    stale = tmp_path / "key.1000-abc.serving"
+    os.link(cached, stale)
+    cached.touch()
+
+    monkeypatch.setattr(cache_service, "_last_serving_sweep", 0.0)
+    cache_service.link_pdf_for_serving(cached)
+    assert fresh.exists()
+    assert not stale.exists()